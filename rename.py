@@ -1,9 +1,9 @@
 import sys
 import os
+import contextlib
 import tempfile
-import re
+import time
 import shlex
-import datetime
 try:
     import winreg
 except Exception:
@@ -32,6 +32,7 @@ from PyQt5.QtWidgets import (
     QDialog,
     QTableWidget,
     QTableWidgetItem,
+    QTableView,
     QComboBox,
     QHeaderView,
     QCheckBox,
@@ -44,59 +45,120 @@ from PyQt5.QtWidgets import (
     QScrollArea,
     QStatusBar,
     QSystemTrayIcon,
+    QProgressDialog,
 )
-from PyQt5.QtCore import QSettings, Qt, pyqtSignal, QDir, QModelIndex, QAbstractNativeEventFilter
-from PyQt5.QtGui import QKeySequence, QIcon, QFont
+from PyQt5.QtCore import QSettings, Qt, pyqtSignal, QDir, QModelIndex, QAbstractNativeEventFilter, QTimer, QThread
+from PyQt5.QtCore import QAbstractTableModel
+from PyQt5.QtGui import QKeySequence, QIcon, QFont, QColor
 from PyQt5.QtWidgets import QShortcut, QFileSystemModel
 from PyQt5.QtCore import QSortFilterProxyModel
 from qt_material import apply_stylesheet
 
+import rename_apply
+import rename_engine
+import rename_fs
+import rename_journal
+import rename_meta
+
 class ExcludeFilterProxyModel(QSortFilterProxyModel):
+    # 规范化路径缓存的上限，超过后清空重建
+    NORM_CACHE_LIMIT = 200000
+
     def __init__(self, parent=None):
         super().__init__(parent)
         self.excluded_paths = set()
         self.hide_all = False
         self.included_paths = set()
+        # 排除/包含集合的路径前缀树，filterAcceptsRow 中按路径深度查询
+        self._excluded_trie = rename_fs.PathTrie()
+        self._included_trie = rename_fs.PathTrie()
+        # filePath -> 规范化路径
+        self._norm_cache = {}
+        # 批量更新：begin_update/commit_update 之间的修改只在提交时刷新一次过滤
+        self._batch_depth = 0
+        self._filter_dirty = False
+
+    def begin_update(self):
+        """开始批量修改过滤条件（可嵌套）"""
+        self._batch_depth += 1
+
+    def commit_update(self):
+        """结束批量修改；最外层提交时，如有变化则只刷新一次过滤"""
+        self._batch_depth -= 1
+        if self._batch_depth == 0 and self._filter_dirty:
+            self._filter_dirty = False
+            self.invalidateFilter()
+
+    @contextlib.contextmanager
+    def batch_update(self):
+        """with 语句形式的 begin_update/commit_update"""
+        self.begin_update()
+        try:
+            yield self
+        finally:
+            self.commit_update()
+
+    def _filter_changed(self):
+        if self._batch_depth:
+            self._filter_dirty = True
+        else:
+            self.invalidateFilter()
+
+    def _normalize(self, path):
+        norm = self._norm_cache.get(path)
+        if norm is None:
+            if len(self._norm_cache) >= self.NORM_CACHE_LIMIT:
+                self._norm_cache.clear()
+            norm = self._norm_cache[path] = rename_fs.normalize_path(path)
+        return norm
 
     def set_excluded(self, paths):
-        self.excluded_paths = set(paths or [])
-        self.invalidateFilter()
+        excluded = {rename_fs.normalize_path(p) for p in (paths or [])}
+        if excluded == self.excluded_paths:
+            return
+        self.excluded_paths = excluded
+        self._excluded_trie = rename_fs.PathTrie(excluded)
+        self._filter_changed()
 
     def clear_excluded(self):
+        if not self.excluded_paths:
+            return
         self.excluded_paths.clear()
-        self.invalidateFilter()
+        self._excluded_trie.clear()
+        self._filter_changed()
 
     def set_hide_all(self, flag: bool):
+        if bool(flag) == self.hide_all:
+            return
         self.hide_all = bool(flag)
-        self.invalidateFilter()
+        self._filter_changed()
 
     def set_included(self, paths):
         # 归一化路径，避免分隔符大小写差异
-        normed = set()
-        for p in (paths or []):
-            try:
-                normed.add(os.path.normcase(os.path.normpath(p)))
-            except Exception:
-                normed.add(p)
-        self.included_paths = normed
-        self.invalidateFilter()
+        included = {rename_fs.normalize_path(p) for p in (paths or [])}
+        if included == self.included_paths:
+            return
+        self.included_paths = included
+        self._included_trie = rename_fs.PathTrie(included)
+        self._filter_changed()
 
     def clear_included(self):
+        if not self.included_paths:
+            return
         self.included_paths.clear()
-        self.invalidateFilter()
+        self._included_trie.clear()
+        self._filter_changed()
 
     def remove_from_included(self, paths):
         changed = False
         for p in (paths or []):
-            try:
-                key = os.path.normcase(os.path.normpath(p))
-            except Exception:
-                key = p
+            key = rename_fs.normalize_path(p)
             if key in self.included_paths:
                 self.included_paths.discard(key)
+                self._included_trie.discard(key)
                 changed = True
         if changed:
-            self.invalidateFilter()
+            self._filter_changed()
 
     def filterAcceptsRow(self, source_row, source_parent):
         if self.hide_all:
@@ -110,28 +172,407 @@ class ExcludeFilterProxyModel(QSortFilterProxyModel):
         except Exception:
             return True
         # 统一规范化
-        try:
-            file_path_norm = os.path.normcase(os.path.normpath(file_path))
-        except Exception:
-            file_path_norm = file_path
-        # 先应用排除规则（排除优先于包含）
-        for p in self.excluded_paths:
-            if file_path_norm == p or file_path_norm.startswith(p + os.sep):
-                return False
+        file_path_norm = self._normalize(file_path)
+        # 先应用排除规则（排除优先于包含）：自身或祖先被排除
+        if self._excluded_trie.covers(file_path_norm):
+            return False
         # 如果设置了包含白名单，仅显示白名单文件与其祖先目录
-        if self.included_paths:
-            for p in self.included_paths:
-                if file_path_norm == p:
-                    return True
-                # file_path 是 p 的祖先（目录）→ 显示祖先链以便展开到白名单项
-                if p.startswith(file_path_norm + os.sep):
-                    return True
-                # file_path 是 p 的后代（当 p 为目录时）→ 显示所选目录的所有子项
-                if file_path_norm.startswith(p + os.sep):
-                    return True
+        if self._included_trie:
+            # 自身或祖先在白名单中 → 显示所选项及所选目录的所有子项
+            # 有后代在白名单中 → 显示祖先链以便展开到白名单项
+            return (
+                self._included_trie.covers(file_path_norm)
+                or self._included_trie.has_descendant(file_path_norm)
+            )
+        return True
+
+
+class PreviewTableModel(QAbstractTableModel):
+    """PowerRename 预览表格模型。
+
+    每行为 (folder, old_name, new_name)；第 0 列通过 CheckStateRole 提供勾选状态，
+    其余列在 data() 中按需计算，只有可见行才会被视图访问。
+    勾选状态保存在共享的 SelectionState 中，row_ids 为每行对应的文件 id；
+    changed 标记新旧名称不同的行，conflicts 为 {行号: 冲突原因}；
+    同一文件夹的行是连续的，冲突也按文件夹分别保存，勾选变化后只需重新检查一个文件夹；
+    “已勾选”“勾选且会被重命名”“勾选且有冲突”的数量随勾选增量维护。
+    """
+    # 用户勾选/取消勾选某一行（参数为行号）
+    check_state_changed = pyqtSignal(int)
+
+    HEADERS = ["", "原始文件名", "重命名后"]
+    CONFLICT_COLOR = QColor("#d32f2f")
+
+    def __init__(self, selection, parent=None):
+        super().__init__(parent)
+        self.selection = selection
+        self.rows = []
+        self.row_ids = []
+        self.changed = bytearray()
+        self.conflicts = {}
+        # 文件夹 -> (起始行, 结束行)；文件夹 -> {行号: 冲突原因}
+        self._folder_ranges = {}
+        self._folder_conflicts = {}
+        self._checked_count = 0
+        self._changed_count = 0
+        self._renamed_count = 0
+        self._conflict_count = 0
+
+    def set_rows(self, rows, row_ids, changed, conflicts=None):
+        """替换全部行；row_ids 为与行对齐的文件 id，changed 为与行对齐的修改标记"""
+        self.beginResetModel()
+        self.rows = rows
+        self.row_ids = row_ids
+        self.changed = changed
+        self._folder_ranges = {}
+        start = 0
+        for row in range(1, len(rows) + 1):
+            if row == len(rows) or rows[row][0] != rows[start][0]:
+                self._folder_ranges[rows[start][0]] = (start, row)
+                start = row
+        self._set_conflicts(conflicts or {})
+        bits = self.selection.bits
+        self._checked_count = sum(map(bits.__getitem__, row_ids))
+        self._changed_count = changed.count(1)
+        self._renamed_count = sum(bits[file_id] for file_id, c in zip(row_ids, changed) if c)
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return self.HEADERS[section]
+        return None
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        flags = Qt.ItemIsEnabled | Qt.ItemIsSelectable
+        if index.column() == 0:
+            flags |= Qt.ItemIsUserCheckable
+        return flags
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row = index.row()
+        column = index.column()
+        if role == Qt.CheckStateRole and column == 0:
+            return Qt.Checked if self.is_checked(row) else Qt.Unchecked
+        if role == Qt.DisplayRole:
+            folder, old_name, new_name = self.rows[row]
+            if column == 1:
+                return old_name
+            if column == 2:
+                # 只有被勾选且会被修改的文件才显示新名称
+                return new_name if self.changed[row] and self.is_checked(row) else ""
+        elif role == Qt.ToolTipRole:
+            if column == 1:
+                return os.path.join(self.rows[row][0], self.rows[row][1])
+            if column == 2:
+                return self.conflicts.get(row)
+        elif role == Qt.ForegroundRole and column == 2 and row in self.conflicts:
+            return self.CONFLICT_COLOR
+        return None
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if not index.isValid() or role != Qt.CheckStateRole or index.column() != 0:
             return False
+        row = index.row()
+        checked = value == Qt.Checked
+        if checked != self.is_checked(row):
+            self.selection.set_checked(self.row_ids[row], checked)
+            delta = 1 if checked else -1
+            self._checked_count += delta
+            if self.changed[row]:
+                self._renamed_count += delta
+            if row in self.conflicts:
+                self._conflict_count += delta
+            self.dataChanged.emit(self.index(row, 0), self.index(row, 2))
+            self.check_state_changed.emit(row)
         return True
 
+    def is_checked(self, row):
+        return self.selection.is_checked(self.row_ids[row])
+
+    def set_all_checked(self, flag):
+        """全选/取消全选"""
+        self.selection.set_all(flag)
+        self._checked_count = len(self.rows) if flag else 0
+        self._renamed_count = self._changed_count if flag else 0
+        self._conflict_count = len(self.conflicts) if flag else 0
+        if self.rows:
+            self.dataChanged.emit(self.index(0, 0), self.index(len(self.rows) - 1, 2))
+
+    def checked_count(self):
+        return self._checked_count
+
+    def renamed_count(self):
+        """被勾选且会被重命名的行数"""
+        return self._renamed_count
+
+    def conflict_count(self):
+        """被勾选且存在冲突的行数"""
+        return self._conflict_count
+
+    def folder_range(self, folder):
+        """返回文件夹的行范围 (起始行, 结束行)"""
+        return self._folder_ranges.get(folder, (0, 0))
+
+    def _set_conflicts(self, conflicts):
+        self.conflicts = dict(conflicts)
+        self._folder_conflicts = {}
+        for row, reason in conflicts.items():
+            self._folder_conflicts.setdefault(self.rows[row][0], {})[row] = reason
+        bits = self.selection.bits
+        self._conflict_count = sum(bits[self.row_ids[row]] for row in conflicts)
+
+    def set_conflicts(self, conflicts):
+        """替换全部冲突标记（全选/取消全选后使用）"""
+        self._set_conflicts(conflicts)
+        if self.rows:
+            self.dataChanged.emit(self.index(0, 2), self.index(len(self.rows) - 1, 2))
+
+    def set_folder_conflicts(self, folder, conflicts):
+        """替换一个文件夹的冲突标记 {行号: 原因}，计数按差值更新，只刷新变化的行"""
+        old = self._folder_conflicts.pop(folder, {})
+        if not old and not conflicts:
+            return
+        for row in old:
+            del self.conflicts[row]
+            if self.is_checked(row):
+                self._conflict_count -= 1
+        for row, reason in conflicts.items():
+            self.conflicts[row] = reason
+            if self.is_checked(row):
+                self._conflict_count += 1
+        if conflicts:
+            self._folder_conflicts[folder] = dict(conflicts)
+        rows = list(old) + list(conflicts)
+        self.dataChanged.emit(self.index(min(rows), 2), self.index(max(rows), 2))
+
+
+# 文件数达到该值时，输入变化后的预览改为去抖 + 后台线程计算
+PREVIEW_ASYNC_THRESHOLD = 2000
+# 预览去抖间隔（毫秒）
+PREVIEW_DEBOUNCE_MS = 150
+
+
+class PreviewWorker(QThread):
+    """在后台线程中计算重命名预览，结果携带代数用于丢弃过期结果"""
+    plan_ready = pyqtSignal(int, object, str)
+    # 读取图片元数据的进度：(代数, 完成数, 总数)
+    progress = pyqtSignal(int, int, int)
+
+    def __init__(self, generation, file_list, options, snapshots=None, metadata=None, parent=None):
+        super().__init__(parent)
+        self.generation = generation
+        self.file_list = file_list
+        self.options = options
+        self.snapshots = snapshots
+        self.metadata = metadata
+
+    def run(self):
+        try:
+            plan = rename_engine.plan(
+                self.file_list, self.options, self.isInterruptionRequested, self.snapshots,
+                self.metadata, lambda done, total: self.progress.emit(self.generation, done, total),
+            )
+        except rename_engine.RenameError as e:
+            self.plan_ready.emit(self.generation, None, str(e))
+            return
+        except Exception as e:
+            # 同样要通知界面，否则预览一直处于未更新状态
+            self.plan_ready.emit(self.generation, None, f"预览计算失败: {e}")
+            return
+        if plan is not None:
+            self.plan_ready.emit(self.generation, plan, "")
+
+
+# 流式载入文件时，每批至少间隔（秒）或累积到该数量后送到界面
+COLLECT_EMIT_INTERVAL = 0.2
+COLLECT_BATCH_FILES = 2000
+# 载入过程中刷新预览的最小间隔（毫秒）
+COLLECT_PREVIEW_INTERVAL_MS = 500
+
+
+class FileCollector(QThread):
+    """在后台线程中消费文件路径批次（如 rename_fs.iter_file_batches），合并后分批送到界面"""
+    files_found = pyqtSignal(object)
+
+    def __init__(self, batches, parent=None):
+        super().__init__(parent)
+        self.batches = batches
+
+    def run(self):
+        pending = []
+        # 第一批立即送出，让窗口尽快显示内容
+        last_emit = 0.0
+        try:
+            for batch in self.batches:
+                if self.isInterruptionRequested():
+                    break
+                pending.extend(batch)
+                # 单个目录可能很大：按 COLLECT_BATCH_FILES 切开送出
+                while len(pending) >= COLLECT_BATCH_FILES:
+                    self.files_found.emit(pending[:COLLECT_BATCH_FILES])
+                    del pending[:COLLECT_BATCH_FILES]
+                    last_emit = time.monotonic()
+                if pending and time.monotonic() - last_emit >= COLLECT_EMIT_INTERVAL:
+                    self.files_found.emit(pending)
+                    pending = []
+                    last_emit = time.monotonic()
+        except Exception as e:
+            print(f"收集文件失败: {e}")
+        finally:
+            close = getattr(self.batches, "close", None)
+            if close is not None:
+                close()
+        if pending and not self.isInterruptionRequested():
+            self.files_found.emit(pending)
+
+
+# 执行步骤数达到该值时，重命名改为在后台线程中执行并显示进度
+RENAME_ASYNC_THRESHOLD = 200
+# 后台重命名的线程数（网络共享上可同时发出多个重命名请求）
+RENAME_WORKERS = 8
+
+
+class RenameWorker(QThread):
+    """在后台线程中用线程池执行 rename_apply.RenameSchedule，结果保存在 results 中；
+    执行中出现异常时异常保存在 error 中"""
+    progress = pyqtSignal(int)
+
+    def __init__(self, schedule, on_step=None, parent=None):
+        super().__init__(parent)
+        self.schedule = schedule
+        self.on_step = on_step
+        self.results = {}
+        self.error = None
+        self._done = 0
+        # 约每 1% 通知一次进度，避免大量信号堆积在事件队列中
+        self._report_every = max(1, schedule.step_count() // 100)
+
+    def _on_step(self, *args):
+        # run_schedule 会对回调加锁，这里无需再同步
+        if self.on_step is not None:
+            self.on_step(*args)
+        self._done += 1
+        if self._done % self._report_every == 0:
+            self.progress.emit(self._done)
+
+    def run(self):
+        try:
+            self.results = rename_apply.run_schedule(
+                self.schedule, self._on_step, RENAME_WORKERS, self.isInterruptionRequested
+            )
+        except Exception as e:
+            self.error = e
+
+
+def run_schedule_with_progress(parent, schedule, on_step, on_finished, undo_of=None):
+    """执行重命名计划，完成后以 {entry_index: 错误信息或 None} 调用 on_finished。
+
+    执行前先把计划写入重命名日志（见 rename_journal），中断后可继续或回滚，完成后可撤销；
+    撤销、回滚时 undo_of 为被撤销的日志路径。
+    步骤较少时直接在当前线程执行；否则在 RenameWorker 中并行执行，
+    显示可取消的进度对话框（取消后已开始的链仍会执行完）。
+    执行中出现异常时提示错误，日志保持未完成状态（下次启动时可继续或回滚），
+    未得到结果的条目记为 rename_apply.REASON_ABORTED。
+    """
+    journal = None
+    try:
+        journal = rename_journal.RenameJournal.create(schedule, undo_of=undo_of)
+    except Exception as e:
+        print(f"写入重命名日志失败，继续执行但无法撤销: {e}")
+    # 按步骤记录已知结果，执行异常中止时据此判断哪些条目已完成
+    recorded = {}
+    callback = on_step
+
+    def on_step(src, dst, index, final, error):
+        if journal is not None:
+            journal.on_step(src, dst, index, final, error)
+        if error is not None or final:
+            recorded[index] = error
+        if callback is not None:
+            callback(src, dst, index, final, error)
+
+    def finish(results, error):
+        try:
+            if error is not None:
+                print(f"重命名执行失败: {error}")
+                QMessageBox.critical(
+                    parent, "错误", f"重命名执行失败，已完成的部分可在下次启动时继续或回滚：\n{error}"
+                )
+                results = dict(schedule.failures)
+                results.update(recorded)
+                for index in range(len(schedule.entries)):
+                    results.setdefault(index, rename_apply.REASON_ABORTED)
+        finally:
+            if journal is not None:
+                try:
+                    journal.close(finished=error is None)
+                except Exception as e:
+                    print(f"关闭重命名日志失败: {e}")
+        on_finished(results)
+
+    total = schedule.step_count()
+    if total < RENAME_ASYNC_THRESHOLD:
+        try:
+            results = rename_apply.run_schedule(schedule, on_step)
+        except Exception as e:
+            finish({}, e)
+        else:
+            finish(results, None)
+        return
+    worker = RenameWorker(schedule, on_step, parent)
+    progress = QProgressDialog("正在重命名…", "取消", 0, total, parent)
+    progress.setWindowTitle("重命名")
+    progress.setWindowModality(Qt.WindowModal)
+    progress.setMinimumDuration(0)
+    progress.setValue(0)
+    worker.progress.connect(progress.setValue)
+    progress.canceled.connect(worker.requestInterruption)
+
+    def finished():
+        progress.canceled.disconnect(worker.requestInterruption)
+        progress.close()
+        progress.deleteLater()
+        finish(worker.results, worker.error)
+        worker.deleteLater()
+
+    worker.finished.connect(finished)
+    worker.start()
+
+
+def print_rename_step(src, dst, index, final, error):
+    """打印执行步骤（撤销、恢复时使用）"""
+    if error is not None:
+        print(f"重命名失败: {src} -> {dst}: {error}")
+    elif final:
+        print(f"重命名成功: {src} -> {dst}")
+
+
+def undo_last_rename(parent, on_finished):
+    """撤销最近一次重命名：按日志逆向执行已完成的步骤，完成后调用 on_finished(schedule, results)"""
+    state = rename_journal.latest_undoable()
+    if state is None:
+        QMessageBox.information(parent, "提示", "没有可撤销的重命名")
+        return
+    schedule = state.inverse_schedule()
+    print(f"撤销重命名: {state.path}，共 {schedule.step_count()} 步")
+
+    def finished(results):
+        # 执行中断时撤销日志保持未完成状态，原日志不标记为已撤销
+        if rename_apply.REASON_ABORTED not in results.values():
+            state.mark_undone()
+        on_finished(schedule, results)
+
+    run_schedule_with_progress(parent, schedule, print_rename_step, finished, undo_of=state.path)
 
 
 class PowerRenameDialog(QWidget):
@@ -140,26 +581,32 @@ class PowerRenameDialog(QWidget):
     
     def __init__(self, file_list, parent=None):
         super().__init__(parent)
-        self.file_list = file_list
-        self.preview_data = []
+        # 文件列表在载入时计算自然排序键，分组排序结果在多次预览间复用
+        self.file_list = rename_engine.FileList(file_list)
+        self.preview_data = rename_engine.RenamePlan()
         self.updating_preview = False  # 添加标志位防止递归调用
+        # 勾选状态按文件路径保存，刷新或重命名后不会错位
+        self.selection = rename_engine.SelectionState()
+        # 目录快照缓存：预览时按目录一次 scandir，代替逐个文件 isfile
+        self.snapshots = rename_fs.SnapshotCache()
+        # 图片元数据缓存（内存 + SQLite），替换文本用到元数据占位符时才会读取
+        self.metadata = rename_meta.MetadataCache()
+        # 后台预览：代数递增使旧结果失效；dirty 表示界面上的预览尚未跟上输入
+        self._preview_generation = 0
+        self._preview_dirty = False
+        self._preview_workers = set()
+        self._preview_timer = QTimer(self)
+        self._preview_timer.setSingleShot(True)
+        self._preview_timer.setInterval(PREVIEW_DEBOUNCE_MS)
+        self._preview_timer.timeout.connect(self.start_preview_worker)
+        # 流式载入文件：后台收集线程与载入期间的预览节流
+        self._collector = None
+        self._load_preview_timer = QTimer(self)
+        self._load_preview_timer.setSingleShot(True)
+        self._load_preview_timer.setInterval(COLLECT_PREVIEW_INTERVAL_MS)
+        self._load_preview_timer.timeout.connect(self.refresh_loading_preview)
         self.initUI()
         
-    def _natural_sort_key(self, path_or_name):
-        """返回用于自然排序的键，使 '1' < '2' < '10'。
-
-        仅对末级文件名进行分段；非数字段使用小写比较以稳定排序。
-        """
-        try:
-            name = os.path.basename(path_or_name)
-        except Exception:
-            name = str(path_or_name)
-        try:
-            parts = re.split(r"(\d+)", name)
-            return [int(p) if p.isdigit() else p.lower() for p in parts]
-        except Exception:
-            return [name.lower()]
-
     def initUI(self):
         self.setWindowTitle("PowerRename")
         self.resize(1200, 700)
@@ -207,17 +654,24 @@ class PowerRenameDialog(QWidget):
         
         self.search_input = QLineEdit()
         self.search_input.setPlaceholderText("输入要查找的文本")
-        self.search_input.textChanged.connect(self.update_preview)
+        self.search_input.textChanged.connect(self.schedule_preview)
         search_layout.addWidget(self.search_input)
         
+        # 查找规则错误提示（如正则表达式无效），默认隐藏
+        self.search_error_label = QLabel()
+        self.search_error_label.setStyleSheet("color: #d32f2f;")
+        self.search_error_label.setWordWrap(True)
+        self.search_error_label.hide()
+        search_layout.addWidget(self.search_error_label)
+        
         # 选项复选框
         options_layout = QVBoxLayout()
         self.regex_checkbox = QCheckBox("使用正则表达式")
-        self.regex_checkbox.stateChanged.connect(self.update_preview)
+        self.regex_checkbox.stateChanged.connect(self.schedule_preview)
         self.match_all_checkbox = QCheckBox("匹配所有出现的对象")
-        self.match_all_checkbox.stateChanged.connect(self.update_preview)
+        self.match_all_checkbox.stateChanged.connect(self.schedule_preview)
         self.case_sensitive_checkbox = QCheckBox("区分大小写")
-        self.case_sensitive_checkbox.stateChanged.connect(self.update_preview)
+        self.case_sensitive_checkbox.stateChanged.connect(self.schedule_preview)
         
         options_layout.addWidget(self.regex_checkbox)
         options_layout.addWidget(self.match_all_checkbox)
@@ -232,8 +686,16 @@ class PowerRenameDialog(QWidget):
         replace_layout = QVBoxLayout()
         
         self.replace_input = QLineEdit()
-        self.replace_input.setPlaceholderText("# 数字, $p 文件夹名, $$p两级文件夹")
-        self.replace_input.textChanged.connect(self.update_preview)
+        self.replace_input.setPlaceholderText("# 数字, $p 文件夹名, $$p两级文件夹, $mYYYY 修改年份")
+        self.replace_input.setToolTip(
+            "# 数字（##=10 从 10 开始两位数）\n"
+            "$p 文件夹名，$$p 两级文件夹\n"
+            "$YYYY $MM $DD 当前日期\n"
+            "$m / $c 加 YYYY MM DD hh mm ss：文件修改 / 创建时间（如 $mYYYY$mMM$mDD）\n"
+            "$e 加 YYYY MM DD hh mm ss：拍摄时间（Exif，缺失时用修改时间）\n"
+            "$width $height 图片尺寸，$camera 相机型号"
+        )
+        self.replace_input.textChanged.connect(self.schedule_preview)
         replace_layout.addWidget(self.replace_input)
         
         # 应用于选项 - 改为复选框，水平布局
@@ -242,13 +704,13 @@ class PowerRenameDialog(QWidget):
         
         self.include_files_checkbox = QCheckBox("包含文件")
         self.include_files_checkbox.setChecked(True)  # 默认勾选
-        self.include_files_checkbox.stateChanged.connect(self.update_preview)
+        self.include_files_checkbox.stateChanged.connect(self.schedule_preview)
         
         self.include_folders_checkbox = QCheckBox("包含文件夹")
-        self.include_folders_checkbox.stateChanged.connect(self.update_preview)
+        self.include_folders_checkbox.stateChanged.connect(self.schedule_preview)
         
         self.include_subfolders_checkbox = QCheckBox("包含子文件夹")
-        self.include_subfolders_checkbox.stateChanged.connect(self.update_preview)
+        self.include_subfolders_checkbox.stateChanged.connect(self.schedule_preview)
         
         apply_layout.addWidget(self.include_files_checkbox)
         apply_layout.addWidget(self.include_folders_checkbox)
@@ -309,6 +771,11 @@ class PowerRenameDialog(QWidget):
         self.apply_btn.clicked.connect(self.apply_rename)
         self.apply_btn.setMinimumWidth(80)  # 设置按钮最小宽度
         
+        self.undo_btn = QPushButton("撤销")
+        self.undo_btn.clicked.connect(self.undo_rename)
+        self.undo_btn.setMinimumWidth(80)
+        
+        button_layout.addWidget(self.undo_btn)
         button_layout.addWidget(self.apply_btn)
         
         layout.addLayout(button_layout)
@@ -350,10 +817,11 @@ class PowerRenameDialog(QWidget):
         
         layout.addLayout(title_layout)
         
-        # 预览表格
-        self.preview_table = QTableWidget()
-        self.preview_table.setColumnCount(3)
-        self.preview_table.setHorizontalHeaderLabels(["", "原始文件名", "重命名后"])
+        # 预览表格（模型/视图，行数据按需显示）
+        self.preview_model = PreviewTableModel(self.selection, self)
+        self.preview_model.check_state_changed.connect(self.on_checkbox_changed)
+        self.preview_table = QTableView()
+        self.preview_table.setModel(self.preview_model)
         
         # 隐藏行号索引
         self.preview_table.verticalHeader().hide()
@@ -365,7 +833,7 @@ class PowerRenameDialog(QWidget):
         header.setSectionResizeMode(2, QHeaderView.Stretch)  # 重命名后列拉伸
         header.resizeSection(0, 30)  # 设置复选框列宽度
         self.preview_table.setAlternatingRowColors(True)
-        self.preview_table.setSelectionBehavior(QTableWidget.SelectRows)
+        self.preview_table.setSelectionBehavior(QTableView.SelectRows)
         
         # 设置表格边距，确保与标题对齐
         self.preview_table.setContentsMargins(0, 0, 0, 0)
@@ -376,63 +844,133 @@ class PowerRenameDialog(QWidget):
         panel.setLayout(layout)
         return panel
         
+    def current_options(self):
+        """根据界面控件状态生成重命名选项"""
+        text_format = None
+        checked_id = self.format_button_group.checkedId()
+        if 0 <= checked_id < len(rename_engine.TEXT_FORMATS):
+            text_format = rename_engine.TEXT_FORMATS[checked_id]
+        return rename_engine.RenameOptions(
+            search_text=self.search_input.text(),
+            replace_text=self.replace_input.text(),
+            use_regex=self.regex_checkbox.isChecked(),
+            match_all=self.match_all_checkbox.isChecked(),
+            case_sensitive=self.case_sensitive_checkbox.isChecked(),
+            include_files=self.include_files_checkbox.isChecked(),
+            include_folders=self.include_folders_checkbox.isChecked(),
+            include_subfolders=self.include_subfolders_checkbox.isChecked(),
+            text_format=text_format,
+        )
+
+    def schedule_preview(self):
+        """输入变化时调度预览：文件较少时直接计算，否则去抖后在后台线程计算。
+
+        替换文本用到图片元数据时总是在后台计算，读取进度显示在“已重命名”标题上。
+        """
+        if len(self.file_list) < PREVIEW_ASYNC_THRESHOLD and not self.needs_metadata():
+            self.update_preview()
+            return
+        self._preview_generation += 1
+        self._preview_dirty = True
+        self.cancel_preview_workers()
+        self.renamed_label.setText("已重命名 (计算中…)")
+        self._preview_timer.start()
+
+    def needs_metadata(self):
+        """替换文本是否用到图片元数据占位符（需要读取文件头，只在后台线程中计算）"""
+        return rename_engine.ReplaceTemplate(self.replace_input.text()).needs_meta
+
+    def start_preview_worker(self):
+        """去抖结束后，以当前界面选项启动后台预览计算"""
+        worker = PreviewWorker(
+            self._preview_generation, self.file_list.copy(), self.current_options(), self.snapshots,
+            self.metadata, self,
+        )
+        worker.plan_ready.connect(self.on_preview_ready)
+        worker.progress.connect(self.on_preview_progress)
+        worker.finished.connect(lambda w=worker: self._on_preview_worker_finished(w))
+        self._preview_workers.add(worker)
+        worker.start()
+
+    def on_preview_ready(self, generation, plan, error):
+        """后台预览完成；只接受最新一代的结果"""
+        if generation != self._preview_generation:
+            return
+        self._preview_dirty = False
+        if error:
+            self.set_search_error(error)
+            self.update_title_counts()
+            return
+        self.set_search_error(None)
+        self.preview_data = plan
+        self.update_preview_table()
+
+    def on_preview_progress(self, generation, done, total):
+        """后台预览读取图片元数据的进度"""
+        if generation == self._preview_generation and done < total:
+            self.renamed_label.setText(f"已重命名 (读取元数据 {done}/{total}…)")
+
+    def cancel_preview_workers(self):
+        """请求中止所有正在进行的后台预览"""
+        for worker in self._preview_workers:
+            worker.requestInterruption()
+
+    def _on_preview_worker_finished(self, worker):
+        self._preview_workers.discard(worker)
+        worker.deleteLater()
+
     def update_preview(self):
-        """更新预览"""
-        search_text = self.search_input.text()
-        replace_text = self.replace_input.text()
-        
+        """更新预览（同步计算）"""
+        # 作废尚未完成的后台预览，避免旧结果覆盖
+        self._preview_generation += 1
+        self._preview_dirty = False
+        self._preview_timer.stop()
+        self.cancel_preview_workers()
         # 始终显示所有原始文件，但根据查找/替换条件更新重命名预览
-        self.preview_data = []
-        
-        # 按文件夹分组文件，用于生成序号
-        from collections import defaultdict
-        folder_to_files = defaultdict(list)
-        for file_path in sorted(self.file_list, key=self._natural_sort_key):
-            if os.path.isfile(file_path):
-                folder_path = os.path.dirname(file_path)
-                folder_to_files[folder_path].append(file_path)
-        
-        for folder_path, files in folder_to_files.items():
-            # 按文件夹内的文件顺序生成序号
-            for index, file_path in enumerate(files):
-                original_name = os.path.basename(file_path)
-                
-                # 如果没有查找文本，重命名列为空
-                if not search_text:
-                    self.preview_data.append((folder_path, original_name, original_name))
-                    continue
-                
-                # 根据"应用于"复选框确定处理范围
-                if self.include_files_checkbox.isChecked():
-                    # 处理文件名
-                    name_part = os.path.splitext(original_name)[0]
-                    ext_part = os.path.splitext(original_name)[1]
-                    new_name_part = self.perform_replace_with_special_chars(
-                        name_part, search_text, replace_text, folder_path, index
-                    )
-                    new_name = new_name_part + ext_part
-                else:
-                    new_name = original_name
-                
-                # 添加所有文件到预览数据中，包括不修改的文件
-                self.preview_data.append((folder_path, original_name, new_name))
-        
+        try:
+            plan = rename_engine.plan(
+                self.file_list, self.current_options(), snapshots=self.snapshots, metadata=self.metadata
+            )
+        except rename_engine.RenameError as e:
+            # 规则无效时跳过整个预览，只提示一次并禁用“应用”
+            self.set_search_error(str(e))
+            return
+        self.set_search_error(None)
+        self.preview_data = plan
         self.update_preview_table()
         
-    def show_original_files(self):
-        """显示原始文件列表"""
-        self.preview_data = []
+    def set_search_error(self, message):
+        """显示或清除预览错误提示（查找规则无效、后台预览失败等）"""
+        if message:
+            if message != self.search_error_label.text():
+                print(f"预览错误: {message}")
+            self.search_error_label.setText(message)
+            self.search_error_label.show()
+        else:
+            self.search_error_label.clear()
+            self.search_error_label.hide()
+        self.update_apply_enabled()
+
+    def update_apply_enabled(self):
+        """查找规则无效、勾选的行存在冲突或文件仍在载入时禁用“应用”"""
+        valid = (
+            not self.search_error_label.text()
+            and self.preview_model.conflict_count() == 0
+            and not self.is_loading()
+        )
+        self.apply_btn.setEnabled(valid)
         
-        # 显示所有原始文件，包括重命名后的文件
-        for file_path in sorted(self.file_list, key=self._natural_sort_key):
-            if not os.path.isfile(file_path):
-                continue
-                
-            original_name = os.path.basename(file_path)
-            folder_path = os.path.dirname(file_path)
-            
-            # 显示原始文件名，用于程序启动时显示
-            self.preview_data.append((folder_path, original_name, original_name))
+    def show_original_files(self):
+        """显示原始文件列表（新的文件列表，勾选状态重置为全选）"""
+        self.selection.clear()
+        # 文件列表的载入时间：update_file_list 只参考此后的重命名日志
+        self._file_list_time = time.time()
+        self._preview_generation += 1
+        self._preview_dirty = False
+        self._preview_timer.stop()
+        self.cancel_preview_workers()
+        # 显示原始文件名，用于程序启动时显示
+        self.preview_data = rename_engine.plan(self.file_list, snapshots=self.snapshots)
         
         print(f"显示原始文件: {len(self.preview_data)} 个文件")
         self.update_preview_table()
@@ -440,183 +978,18 @@ class PowerRenameDialog(QWidget):
     def apply_text_format(self):
         """应用文本格式 - 触发预览更新"""
         # 文本格式改变时，重新计算预览
-        self.update_preview()
-        
-    def format_text(self, text, button):
-        """根据选中的按钮格式化文本"""
-        if button == self.lowercase_radio:
-            return text.lower()
-        elif button == self.uppercase_radio:
-            return text.upper()
-        elif button == self.capitalize_radio:
-            return text.capitalize()
-        elif button == self.title_radio:
-            return text.title()
-        return text
-        
-    def perform_replace(self, text, search_text, replace_text):
-        """执行替换操作"""
-        if not search_text:
-            return text
-            
-        try:
-            if self.regex_checkbox.isChecked():
-                # 使用正则表达式
-                flags = 0 if self.case_sensitive_checkbox.isChecked() else re.IGNORECASE
-                if self.match_all_checkbox.isChecked():
-                    new_text = re.sub(search_text, replace_text, text, flags=flags)
-                else:
-                    new_text = re.sub(search_text, replace_text, text, count=1, flags=flags)
-            else:
-                # 普通文本替换
-                if self.case_sensitive_checkbox.isChecked():
-                    if self.match_all_checkbox.isChecked():
-                        new_text = text.replace(search_text, replace_text)
-                    else:
-                        new_text = text.replace(search_text, replace_text, 1)
-                else:
-                    # 不区分大小写 - 使用简单的不区分大小写替换
-                    new_text = self.case_insensitive_replace(text, search_text, replace_text, self.match_all_checkbox.isChecked())
-        except Exception as e:
-            print(f"替换错误: {e}")
-            print(f"查找文本: '{search_text}'")
-            print(f"替换文本: '{replace_text}'")
-            print(f"原文本: '{text}'")
-            print(f"使用正则表达式: {self.regex_checkbox.isChecked()}")
-            print(f"区分大小写: {self.case_sensitive_checkbox.isChecked()}")
-            print(f"匹配所有: {self.match_all_checkbox.isChecked()}")
-            
-            # 如果正则表达式失败，回退到普通字符串替换
-            try:
-                if self.case_sensitive_checkbox.isChecked():
-                    new_text = text.replace(search_text, replace_text)
-                else:
-                    # 不区分大小写的简单替换
-                    new_text = text.replace(search_text.lower(), replace_text.lower())
-                    # 如果小写替换没有效果，尝试原样替换
-                    if new_text == text:
-                        new_text = text.replace(search_text, replace_text)
-            except Exception as e2:
-                print(f"回退替换也失败: {e2}")
-                return text
-        
-        # 应用文本格式到替换后的文本
-        new_text = self.apply_text_format_to_result(new_text)
-        return new_text
-
-    def perform_replace_with_special_chars(self, text, search_text, replace_text, folder_path, index):
-        """执行带有特殊字符的替换操作"""
-        if not search_text:
-            return text
-            
-        # 首先进行普通的查找替换
-        new_text = self.perform_replace(text, search_text, replace_text)
-        
-        # 然后处理替换文本中的特殊字符
-        if replace_text:
-            # 获取文件夹信息
-            folder_name = os.path.basename(folder_path)
-            parent_folder_name = os.path.basename(os.path.dirname(folder_path))
-            
-            # 获取当前日期
-            now = datetime.datetime.now()
-            
-            # 处理日期格式
-            new_text = new_text.replace("$YYYY", str(now.year))  # 年，如 2025
-            new_text = new_text.replace("$MM", f"{now.month:02d}")  # 月，如 02
-            new_text = new_text.replace("$DD", f"{now.day:02d}")  # 日，如 02
-            new_text = new_text.replace("$yyyy", str(now.year))  # 年，如 2025
-            new_text = new_text.replace("$mm", f"{now.month:02d}")  # 月，如 02
-            new_text = new_text.replace("$dd", f"{now.day:02d}")  # 日，如 02
-            
-            # 处理 # 字符 - 数字序号（支持新的格式）
-            import re
-            
-            # 先处理带等号的格式，如 #=1, ##=1, ###=21
-            # 匹配 # 后跟 = 再跟数字的模式，如 #=1, ##=1, ###=21
-            hash_equals_number_pattern = r'#+=(\d+)'
-            matches = re.finditer(hash_equals_number_pattern, new_text)
-            
-            # 从后往前替换，避免位置偏移问题
-            for match in reversed(list(matches)):
-                full_match = match.group()
-                start_number = int(match.group(1))
-                # 计算 # 的数量：总长度 - = 的长度 - 数字的长度
-                hash_count = len(full_match) - 1 - len(match.group(1))
-                
-                # 计算实际数字：index + start_number
-                actual_number = index + start_number
-                number_format = f"{{:0{hash_count}d}}"
-                formatted_number = number_format.format(actual_number)
-                
-                # 替换匹配的部分
-                new_text = new_text[:match.start()] + formatted_number + new_text[match.end():]
-            
-            # 处理纯 # 字符 - 数字序号（原有功能，不包含等号和数字的）
-            # 只处理不包含等号和数字的纯 # 序列
-            pure_hash_pattern = r'#+(?![=0-9])'
-            pure_matches = re.finditer(pure_hash_pattern, new_text)
-            
-            for match in reversed(list(pure_matches)):
-                hash_group = match.group()
-                number_format = f"{{:0{len(hash_group)}d}}"
-                formatted_number = number_format.format(index)
-                new_text = new_text[:match.start()] + formatted_number + new_text[match.end():]
-            
-            # 处理 $p 和 $$p - 文件夹名
-            new_text = new_text.replace("$$p", f"{parent_folder_name}_{folder_name}")
-            new_text = new_text.replace("$$P", f"{parent_folder_name}_{folder_name}")
-            new_text = new_text.replace("$p", folder_name)
-        
-        return new_text
-        
-    def apply_text_format_to_result(self, text):
-        """对重命名结果应用文本格式"""
-        # 获取当前选中的格式按钮
-        selected_button = self.format_button_group.checkedButton()
-        if not selected_button:
-            return text
-            
-        return self.format_text(text, selected_button)
-        
-    def case_insensitive_replace(self, text, search_text, replace_text, replace_all=True):
-        """不区分大小写的字符串替换"""
-        if not search_text:
-            return text
-            
-        result = text
-        search_lower = search_text.lower()
-        text_lower = text.lower()
-        
-        if replace_all:
-            # 替换所有匹配项
-            start = 0
-            while True:
-                pos = text_lower.find(search_lower, start)
-                if pos == -1:
-                    break
-                # 找到匹配位置，进行替换
-                result = result[:pos] + replace_text + result[pos + len(search_text):]
-                text_lower = result.lower()  # 更新小写版本
-                start = pos + len(replace_text)
-        else:
-            # 只替换第一个匹配项
-            pos = text_lower.find(search_lower)
-            if pos != -1:
-                result = result[:pos] + replace_text + result[pos + len(search_text):]
-                
-        return result
+        self.schedule_preview()
         
-    def on_checkbox_changed(self):
+    def on_checkbox_changed(self, row):
         """复选框状态变化时的处理"""
         # 防止递归调用
         if self.updating_preview:
             return
             
-        # 更新全选复选框状态
+        # 更新全选复选框状态与标题统计（模型已自行刷新该行显示）
         self.update_select_all_checkbox_state()
-        # 无论是否有查找文本，都需要更新预览表格以反映复选框状态
-        self.update_preview_table()
+        self.refresh_conflicts(row)
+        self.update_title_counts()
     
     def toggle_select_all(self, state):
         """全选/取消全选所有复选框"""
@@ -624,45 +997,57 @@ class PowerRenameDialog(QWidget):
         if self.updating_preview:
             return
             
-        is_checked = state == Qt.Checked
-        for row in range(self.preview_table.rowCount()):
-            checkbox = self.preview_table.cellWidget(row, 0)
-            if checkbox:
-                # 阻止信号，避免在设置状态时触发信号
-                checkbox.blockSignals(True)
-                checkbox.setChecked(is_checked)
-                checkbox.blockSignals(False)
-        
-        # 全选/取消全选后，更新预览显示
-        self.update_rename_column_display()
+        self.preview_model.set_all_checked(state == Qt.Checked)
+        # 全部勾选时即为预览时的冲突；全部取消时没有行会被改名
+        self.preview_model.set_conflicts(self.preview_data.conflicts if state == Qt.Checked else {})
         # 更新标题统计
         self.update_title_counts()
     
+    def refresh_conflicts(self, row):
+        """第 row 行的勾选变化后，按实际勾选的行重新检查该行所在文件夹的冲突。
+
+        冲突只发生在同一文件夹内，因此只检查一个文件夹（一次快照校验）。
+        """
+        folder = self.preview_model.rows[row][0]
+        self.preview_model.set_folder_conflicts(folder, self.checked_folder_conflicts(folder))
+
+    def checked_folder_conflicts(self, folder):
+        """按实际勾选的行检查一个文件夹的冲突，返回 {行号: 原因}"""
+        model = self.preview_model
+        start, stop = model.folder_range(folder)
+        # 未勾选的行保持原名，仍占用原名称
+        entries = [
+            model.rows[r] if model.is_checked(r) else (folder, model.rows[r][1], model.rows[r][1])
+            for r in range(start, stop)
+        ]
+        conflicts = rename_apply.find_conflicts(entries, self.snapshots)
+        return {start + i: reason for i, reason in conflicts.items()}
+
+    def update_conflicts(self):
+        """表格行更新后，按实际勾选的行修正冲突标记。
+
+        预览按“所有改名都会执行”检查冲突；只有含未勾选、且名称会变的行的文件夹结果不同，
+        只重新检查这些文件夹。
+        """
+        model = self.preview_model
+        bits = self.selection.bits
+        folders = {
+            model.rows[row][0]
+            for row, (file_id, changed) in enumerate(zip(model.row_ids, model.changed))
+            if changed and not bits[file_id]
+        }
+        for folder in folders:
+            model.set_folder_conflicts(folder, self.checked_folder_conflicts(folder))
+
     def update_select_all_checkbox_state(self):
         """更新全选复选框的状态"""
-        if self.preview_table.rowCount() == 0:
-            # 阻止信号，避免在设置状态时触发信号
-            self.select_all_checkbox.blockSignals(True)
-            self.select_all_checkbox.setChecked(False)
-            self.select_all_checkbox.blockSignals(False)
-            return
-            
-        checked_count = 0
-        for row in range(self.preview_table.rowCount()):
-            checkbox = self.preview_table.cellWidget(row, 0)
-            if checkbox and checkbox.isChecked():
-                checked_count += 1
+        row_count = self.preview_model.rowCount()
+        checked_count = self.preview_model.checked_count() if row_count else 0
         
         # 阻止信号，避免在设置状态时触发信号
         self.select_all_checkbox.blockSignals(True)
-        # 根据选中状态更新全选复选框
-        if checked_count == 0:
-            self.select_all_checkbox.setChecked(False)
-        elif checked_count == self.preview_table.rowCount():
-            self.select_all_checkbox.setChecked(True)
-        else:
-            # 部分选中状态，可以设置为三态复选框
-            self.select_all_checkbox.setChecked(False)
+        # 全部选中时勾选，部分选中或没有行时不勾选
+        self.select_all_checkbox.setChecked(row_count > 0 and checked_count == row_count)
         self.select_all_checkbox.blockSignals(False)
         
     def update_preview_table(self):
@@ -671,42 +1056,18 @@ class PowerRenameDialog(QWidget):
         self.updating_preview = True
         
         try:
-            # 保存当前复选框状态
-            checkbox_states = {}
-            for row in range(self.preview_table.rowCount()):
-                checkbox = self.preview_table.cellWidget(row, 0)
-                if checkbox:
-                    checkbox_states[row] = checkbox.isChecked()
-            
-            self.preview_table.setRowCount(len(self.preview_data))
-            
-            for row, (folder, old_name, new_name) in enumerate(self.preview_data):
-                # 第一列：复选框
-                checkbox = QCheckBox()
-                # 阻止信号，避免在设置状态时触发信号
-                checkbox.blockSignals(True)
-                # 恢复之前的选中状态，如果没有则默认选中
-                checkbox.setChecked(checkbox_states.get(row, True))
-                # 重新启用信号
-                checkbox.blockSignals(False)
-                # 连接复选框状态变化信号，实时更新预览
-                checkbox.stateChanged.connect(self.on_checkbox_changed)
-                self.preview_table.setCellWidget(row, 0, checkbox)
-                
-                # 第二列：原始文件名
-                self.preview_table.setItem(row, 1, QTableWidgetItem(old_name))
-                
-                # 第三列：重命名后 - 根据复选框状态和修改情况显示
-                # 注意：这里需要在复选框创建之后才能获取其状态
-                # 所以先设置一个占位符，稍后更新
-                self.preview_table.setItem(row, 2, QTableWidgetItem(""))
+            # 勾选状态按文件路径查找，新出现的文件默认勾选
+            id_for = self.selection.id_for
+            join = os.path.join
+            row_ids = [id_for(join(folder, old_name)) for folder, old_name, new_name in self.preview_data]
+            self.preview_model.set_rows(
+                self.preview_data.entries, row_ids, self.preview_data.changed_mask, self.preview_data.conflicts
+            )
+            self.update_conflicts()
             
             # 更新全选复选框状态
             self.update_select_all_checkbox_state()
             
-            # 更新"重命名后"列的显示
-            self.update_rename_column_display()
-            
             # 更新标题统计
             self.update_title_counts()
             
@@ -714,58 +1075,46 @@ class PowerRenameDialog(QWidget):
             # 重置标志位
             self.updating_preview = False
     
-    def update_rename_column_display(self):
-        """更新"重命名后"列的显示，根据复选框状态和修改情况"""
-        for row in range(self.preview_table.rowCount()):
-            if row < len(self.preview_data):
-                folder, old_name, new_name = self.preview_data[row]
-                checkbox = self.preview_table.cellWidget(row, 0)
-                
-                if checkbox and checkbox.isChecked() and new_name != old_name:
-                    # 只有被勾选且会被修改的文件才显示新名称
-                    self.preview_table.setItem(row, 2, QTableWidgetItem(new_name))
-                else:
-                    # 未勾选或不会被修改的文件显示空
-                    self.preview_table.setItem(row, 2, QTableWidgetItem(""))
-    
     def update_title_counts(self):
         """更新标题统计信息"""
         total_files = len(self.file_list)
-        # 计算被勾选且会被重命名的文件数量
-        rename_files = 0
-        for row in range(self.preview_table.rowCount()):
-            checkbox = self.preview_table.cellWidget(row, 0)
-            if checkbox and checkbox.isChecked() and row < len(self.preview_data):
-                folder, old_name, new_name = self.preview_data[row]
-                if new_name != old_name:
-                    rename_files += 1
-        self.original_label.setText(f"原始 ({total_files})")
-        self.renamed_label.setText(f"已重命名 ({rename_files})")
+        # 被勾选且会被重命名的文件数量由模型增量维护
+        if self.is_loading():
+            self.original_label.setText(f"原始 ({total_files}，载入中…)")
+        else:
+            self.original_label.setText(f"原始 ({total_files})")
+        renamed_text = f"已重命名 ({self.preview_model.renamed_count()})"
+        conflict_count = self.preview_model.conflict_count()
+        if conflict_count:
+            renamed_text += f"  冲突 ({conflict_count})"
+        self.renamed_label.setText(renamed_text)
+        self.update_apply_enabled()
         
     def get_current_selected_files(self):
         """获取当前被勾选的文件路径列表"""
-        selected_files = []
-        for row in range(self.preview_table.rowCount()):
-            checkbox = self.preview_table.cellWidget(row, 0)
-            if checkbox and checkbox.isChecked():
-                if row < len(self.preview_data):
-                    folder, old_name, new_name = self.preview_data[row]
-                    file_path = os.path.join(folder, old_name)
-                    selected_files.append(file_path)
-        return selected_files
+        model = self.preview_model
+        return [
+            os.path.join(folder, old_name)
+            for row, (folder, old_name, new_name) in enumerate(model.rows)
+            if model.is_checked(row)
+        ]
 
     def get_selected_files(self):
         """获取被勾选的文件列表"""
-        selected_files = []
-        for row in range(self.preview_table.rowCount()):
-            checkbox = self.preview_table.cellWidget(row, 0)
-            if checkbox and checkbox.isChecked():
-                if row < len(self.preview_data):
-                    selected_files.append(self.preview_data[row])
-        return selected_files
+        model = self.preview_model
+        return [entry for row, entry in enumerate(model.rows) if model.is_checked(row)]
 
     def apply_rename(self):
         """应用重命名"""
+        # 预览尚未跟上最新输入时，先同步计算，保证按所见结果重命名；
+        # 需要读取元数据时不在界面线程中计算，等后台预览完成
+        if self._preview_dirty:
+            if self.needs_metadata():
+                QMessageBox.information(self, "提示", "预览仍在读取元数据，请稍候再应用")
+                return
+            self.update_preview()
+            if not self.apply_btn.isEnabled():
+                return
         # 获取被勾选的文件
         selected_files = self.get_selected_files()
         if not selected_files:
@@ -773,42 +1122,56 @@ class PowerRenameDialog(QWidget):
             return
             
         try:
-            success_count = 0
-            failed_files = []
-            actual_rename_count = 0
-            
             print(f"开始重命名，共 {len(selected_files)} 个选中文件")
             
-            for folder, old_name, new_name in selected_files:
-                # 跳过文件名相同的文件（不需要重命名）
-                if old_name == new_name:
-                    print(f"跳过相同文件名: {old_name}")
-                    continue
+            # 跳过文件名相同的文件（不需要重命名）
+            entries = [entry for entry in selected_files if entry[1] != entry[2]]
+            
+            # 先在内存中规划顺序：目标被另一个待改名文件占用时先改那个文件，互换等成环情况借助临时名称
+            schedule = rename_apply.schedule_renames(entries, self.snapshots)
+            print(f"规划完成: {schedule.step_count()} 步，冲突 {len(schedule.failures)} 个")
+            if schedule.failures:
+                # 存在冲突时一个文件都不改，避免只完成一部分
+                lines = [f"{entries[index][1]}: {reason}" for index, reason in sorted(schedule.failures.items())[:10]]
+                if len(schedule.failures) > 10:
+                    lines.append(f"…… 共 {len(schedule.failures)} 个冲突")
+                QMessageBox.warning(self, "无法重命名", "以下文件存在冲突，未进行任何重命名：\n" + "\n".join(lines))
+                self.schedule_preview()
+                return
+            
+            def on_step(src, dst, index, final, error):
+                if error is not None:
+                    print(f"重命名失败: {src} -> {dst}: {error}")
+                elif final:
+                    print(f"重命名成功: {src} -> {dst}")
+                else:
+                    print(f"移到临时名称: {src} -> {dst}")
                     
-                actual_rename_count += 1
-                old_path = os.path.join(folder, old_name)
-                new_path = os.path.join(folder, new_name)
-                
-                print(f"尝试重命名: {old_path} -> {new_path}")
-                print(f"原文件存在: {os.path.exists(old_path)}")
-                print(f"新文件存在: {os.path.exists(new_path)}")
-                
-                if os.path.exists(old_path):
-                    if not os.path.exists(new_path):
-                        try:
-                            os.rename(old_path, new_path)
-                            success_count += 1
-                            print(f"重命名成功: {old_name} -> {new_name}")
-                        except Exception as e:
-                            print(f"重命名失败: {e}")
-                            failed_files.append(f"{old_name}: {str(e)}")
-                    else:
-                        # 目标文件已存在，直接提示失败
-                        print(f"目标文件已存在: {new_path}")
-                        failed_files.append(f"{old_name}: 目标文件已存在")
+            run_schedule_with_progress(
+                self, schedule, on_step,
+                lambda results: self.on_rename_finished(selected_files, entries, schedule, results),
+            )
+            
+        except Exception as e:
+            QMessageBox.critical(self, "错误", f"重命名失败: {str(e)}")
+            print(f"重命名异常: {e}")
+            
+    def on_rename_finished(self, selected_files, entries, schedule, results):
+        """重命名执行完成（可能在后台线程中执行）后汇总结果并刷新预览"""
+        try:
+            success_count = 0
+            failed_files = []
+            actual_rename_count = len(entries)
+            renamed = {}
+            for index, (folder, old_name, new_name) in enumerate(entries):
+                error = results.get(index, rename_apply.REASON_ABORTED)
+                if error is None:
+                    renamed[os.path.join(folder, old_name)] = os.path.join(folder, new_name)
+                    success_count += 1
                 else:
-                    print(f"原文件不存在: {old_path}")
-                    failed_files.append(f"{old_name}: 原文件不存在")
+                    failed_files.append(f"{old_name}: {error}")
+            # 链式改名或成环时必须整体转移勾选状态
+            self.selection.rename_paths(renamed)
                     
             # 显示重命名结果
             if failed_files:
@@ -817,66 +1180,177 @@ class PowerRenameDialog(QWidget):
                 pass
             
             print(f"重命名完成: 选中 {len(selected_files)} 个，实际重命名 {actual_rename_count} 个，成功 {success_count} 个，失败 {len(failed_files)} 个")
+            
+            # 目录已被修改，下次预览时重新扫描
+            for folder in schedule.steps:
+                self.snapshots.invalidate(folder)
                 
-            # 重命名完成后重新获取文件列表并显示
-            self.refresh_file_list_after_rename()
-            self.update_preview()  # 使用update_preview而不是show_original_files
+            # 按执行结果就地更新文件列表，不重新扫描目录，也不引入未选择的文件
+            paths = rename_apply.resolve_paths(schedule, results)
+            self.remap_file_list(paths)
+            # 改名不改变文件大小与 mtime，元数据缓存跟随新路径，无需重新读取
+            self.metadata.rename_paths(paths)
+            # 本次日志已体现在文件列表中，update_file_list 只参考此后的日志
+            self._file_list_time = time.time()
+            self.schedule_preview()
             
         except Exception as e:
             QMessageBox.critical(self, "错误", f"重命名失败: {str(e)}")
             print(f"重命名异常: {e}")
             
+    def undo_rename(self):
+        """撤销最近一次重命名"""
+        undo_last_rename(self, self.on_undo_finished)
+        
+    def on_undo_finished(self, schedule, results):
+        """撤销完成后同步勾选状态并刷新预览"""
+        failed_count = 0
+        renamed = {}
+        for index, (folder, old_name, new_name) in enumerate(schedule.entries):
+            if results.get(index, rename_apply.REASON_ABORTED) is None:
+                renamed[os.path.join(folder, old_name)] = os.path.join(folder, new_name)
+            else:
+                failed_count += 1
+        self.selection.rename_paths(renamed)
+        if failed_count:
+            QMessageBox.warning(self, "撤销完成", f"撤销 {len(schedule.entries)} 个文件，失败 {failed_count} 个")
+        for folder in schedule.steps:
+            self.snapshots.invalidate(folder)
+        paths = rename_apply.resolve_paths(schedule, results)
+        self.remap_file_list(paths)
+        self.metadata.rename_paths(paths)
+        self._file_list_time = time.time()
+        self.schedule_preview()
+        
+    def refresh_file_list(self):
+        """其他窗口（主窗口的重命名或撤销）修改文件后调用：按重命名日志更新文件列表并刷新预览"""
+        if self.is_loading():
+            return
+        self.snapshots.invalidate()
+        if self.update_file_list():
+            self.schedule_preview()
+        
     def update_file_list(self):
-        """更新文件列表，只更新重命名后的文件路径"""
-        # 不重新扫描整个目录，只更新已重命名的文件路径
-        updated_files = []
+        """更新文件列表：已不存在的文件按重命名日志找到新路径，仍找不到的移除；返回列表是否变化"""
+        # 每个文件夹只扫描一次，存在性检查在内存中完成
+        snapshots = {}
+
+        def exists(file_path):
+            folder = os.path.dirname(file_path)
+            if folder not in snapshots:
+                snapshots[folder] = self.snapshots.get(folder)
+            snapshot = snapshots[folder]
+            return snapshot is not None and snapshot.is_file(os.path.basename(file_path))
+
+        missing = [file_path for file_path in self.file_list if not exists(file_path)]
+        if not missing:
+            return False
+        # 不存在的文件可能已被重命名（本窗口、主窗口或撤销），按载入列表后的重命名日志找到现路径；
+        # 原路径可能已被其他文件占用（如互换），因此日志中有记录的路径都以日志为准
+        renamed = rename_journal.renamed_paths(since=self._file_list_time)
+        paths = {}
         for file_path in self.file_list:
-            if os.path.exists(file_path):
-                updated_files.append(file_path)
-            else:
-                # 如果原文件不存在，可能是被重命名了，尝试找到新文件
-                folder = os.path.dirname(file_path)
-                original_name = os.path.basename(file_path)
-                
-                # 在同一个目录下查找可能的匹配文件
-                if os.path.exists(folder):
-                    for filename in os.listdir(folder):
-                        full_path = os.path.join(folder, filename)
-                        if os.path.isfile(full_path):
-                            # 检查是否是重命名后的文件（通过时间戳等判断）
-                            # 这里简化处理，直接添加找到的文件
-                            updated_files.append(full_path)
-        
-        # 限制文件数量，避免扫描过多文件
-        if len(updated_files) > 1000:
-            updated_files = updated_files[:1000]
-            
-        self.file_list = updated_files
+            new_path = renamed.get(file_path)
+            if new_path is not None and exists(new_path):
+                paths[file_path] = new_path
+        for file_path in missing:
+            paths.setdefault(file_path, None)
+
+        self.selection.rename_paths({old: new for old, new in paths.items() if new is not None})
+        self._replace_paths(paths)
+        print(f"更新文件列表: {len(missing)} 个文件已不存在，{len(self.file_list)} 个文件")
+        return True
         
-    def refresh_file_list_after_rename(self):
-        """重命名后刷新文件列表"""
-        # 重新扫描完整文件夹内容
-        new_file_list = []
+    def remap_file_list(self, paths):
+        """按 {原路径: 现路径} 更新文件列表，现路径为 None 的文件被移除"""
+        if not paths:
+            return
+        self._replace_paths(paths)
+        print(f"重命名后更新文件列表: {len(self.file_list)} 个文件")
+        
+    def _replace_paths(self, paths):
+        """按 {原路径: 现路径} 重建文件列表（去重），未变化的文件沿用已算好的排序键"""
+        remapped = (paths.get(file_path, file_path) for file_path in self.file_list)
+        self.file_list = rename_engine.FileList(
+            (file_path for file_path in remapped if file_path is not None), self.file_list.sort_keys
+        )
         
-        # 从原始文件列表中获取所有目录
-        folders = set()
-        for file_path in self.file_list:
-            folder = os.path.dirname(file_path)
-            folders.add(folder)
+    def set_files(self, files):
+        """替换文件列表（去重）并显示原始文件"""
+        self.stop_loading()
+        self.file_list = rename_engine.FileList(files)
+        self.show_original_files()
         
-        # 扫描每个目录中的所有文件
-        for folder in folders:
-            if os.path.exists(folder):
-                for filename in os.listdir(folder):
-                    full_path = os.path.join(folder, filename)
-                    if os.path.isfile(full_path):
-                        new_file_list.append(full_path)
+    def load_files(self, batches):
+        """流式载入文件：batches 为文件路径列表的可迭代对象（如 rename_fs.iter_file_batches），
+        在后台线程中消费，窗口随批次到达逐步显示并刷新预览；载入完成前禁用“应用”。
+        """
+        self.stop_loading()
+        self.file_list = rename_engine.FileList()
+        collector = FileCollector(batches, self)
+        collector.files_found.connect(self.on_files_found)
+        collector.finished.connect(lambda c=collector: self.on_loading_finished(c))
+        self._collector = collector
+        self.show_original_files()
+        collector.start()
+        
+    def is_loading(self):
+        return self._collector is not None
         
-        self.file_list = new_file_list
-        print(f"重命名后刷新文件列表: {len(self.file_list)} 个文件")
+    def stop_loading(self):
+        """中止正在进行的流式载入"""
+        collector = self._collector
+        if collector is None:
+            return
+        self._collector = None
+        self._load_preview_timer.stop()
+        collector.requestInterruption()
+        collector.wait()
+        collector.deleteLater()
+        
+    def on_files_found(self, batch):
+        """收集线程送来一批文件：去重后追加，首批立即预览，之后节流刷新"""
+        if self.sender() is not self._collector:
+            return
+        first = not self.file_list
+        if not self.file_list.extend(batch):
+            return
+        if first:
+            if self.needs_metadata():
+                # 元数据在后台读取，先显示原始文件名
+                self.preview_data = rename_engine.plan(self.file_list, snapshots=self.snapshots)
+                self.update_preview_table()
+            self.schedule_preview()
+        elif not self._load_preview_timer.isActive():
+            self._load_preview_timer.start()
+        self.update_title_counts()
+        
+    def refresh_loading_preview(self):
+        """载入期间的节流刷新：上一次后台预览尚未完成时顺延，避免反复作废"""
+        if self._preview_workers or self._preview_timer.isActive():
+            self._load_preview_timer.start()
+            return
+        self.schedule_preview()
+        
+    def on_loading_finished(self, collector):
+        if collector is not self._collector:
+            return
+        self._collector = None
+        self._load_preview_timer.stop()
+        collector.deleteLater()
+        print(f"文件载入完成: {len(self.file_list)} 个文件")
+        self.schedule_preview()
+        self.update_title_counts()
         
     def closeEvent(self, event):
         """窗口关闭事件"""
+        self.stop_loading()
+        self._preview_timer.stop()
+        self.cancel_preview_workers()
+        # 线程以本窗口为父对象，须等它真正结束，否则随窗口销毁时仍在运行；
+        # 计算中定期检查中止请求，等待时间很短
+        for worker in list(self._preview_workers):
+            worker.wait()
         self.window_closed.emit()
         super().closeEvent(event)
 
@@ -921,7 +1395,11 @@ class FileOrganizer(QWidget):
         self._balloon_shown = False
         self._hotkey_filter = None
         self.power_rename_window = None  # 添加PowerRename窗口实例管理
+        # 目录快照缓存：预览/重命名时文件夹名称的实际大小写与冲突检查按目录只扫描一次
+        self.snapshots = rename_fs.SnapshotCache()
         self.initUI()
+        # 启动后检查上次是否有中断的重命名
+        QTimer.singleShot(0, self.recover_interrupted_renames)
 
         # 设置图标路径
         icon_path = os.path.join(os.path.dirname(__file__), "icon", "rename.ico")
@@ -1080,6 +1558,9 @@ class FileOrganizer(QWidget):
         # 预览按钮
         self.preview_button = QPushButton("预览", self)
         self.preview_button.clicked.connect(self.preview_rename)
+        # 撤销按钮
+        self.undo_button = QPushButton("撤销", self)
+        self.undo_button.clicked.connect(self.undo_rename)
 
         # 新增帮助按钮
         self.help_button = QPushButton("帮助", self)
@@ -1094,6 +1575,7 @@ class FileOrganizer(QWidget):
         # right_bottom_layout.addWidget(self.replace_line_edit)
         right_bottom_layout.addWidget(self.start_button)
         right_bottom_layout.addWidget(self.preview_button)
+        right_bottom_layout.addWidget(self.undo_button)
         right_bottom_layout.addWidget(self.power_rename_button)
         right_bottom_layout.addWidget(self.help_button)
 
@@ -1287,10 +1769,6 @@ class FileOrganizer(QWidget):
         else:
             target_dir = common_parent(unique_dirs)
         if target_dir and os.path.isdir(target_dir):
-            # 清空之前的过滤状态并准备新的过滤
-            self._right_excluded_paths = []
-            self.right_proxy.clear_excluded()
-            self.right_proxy.set_hide_all(False)
             # 根据选择内容设置白名单：
             # - 若选择了文件：仅显示这些文件（及其祖先目录）
             # - 否则若选择了文件夹：仅显示这些文件夹及其所有子项
@@ -1301,18 +1779,21 @@ class FileOrganizer(QWidget):
                     selected_files.append(p)
                 elif os.path.isdir(p):
                     selected_dirs.append(p)
-            if selected_files:
-                self.right_proxy.set_included(set(selected_files))
-            elif selected_dirs:
-                self.right_proxy.set_included(set(selected_dirs))
-            else:
-                self.right_proxy.clear_included()
+            # 清空之前的过滤状态并设置新的过滤，所有修改只刷新一次
+            self._right_excluded_paths = []
+            with self.right_proxy.batch_update():
+                self.right_proxy.clear_excluded()
+                self.right_proxy.set_hide_all(False)
+                if selected_files:
+                    self.right_proxy.set_included(set(selected_files))
+                elif selected_dirs:
+                    self.right_proxy.set_included(set(selected_dirs))
+                else:
+                    self.right_proxy.clear_included()
             # 最后再设置右侧根到共同父目录（确保过滤状态已生效）
             self.right_tree.setRootIndex(self.right_proxy.mapFromSource(self.right_model.index(target_dir)))
             # 取消空目录根
             self._empty_dir = None
-            # 强制刷新与计数
-            self.right_proxy.invalidate()
             # self.update_file_count()
 
 
@@ -1336,20 +1817,21 @@ class FileOrganizer(QWidget):
                 removed_files.append(file_path)
         # 去重并设置过滤
         self._right_excluded_paths = [os.path.normcase(os.path.normpath(p)) for p in dict.fromkeys(excluded)]
-        self.right_proxy.set_excluded(self._right_excluded_paths)
         # 若当前处于白名单模式（白名单非空），同步从白名单删除被移除的文件
-        if hasattr(self, 'right_proxy') and getattr(self.right_proxy, 'included_paths', None):
-            if len(self.right_proxy.included_paths) > 0:
+        whitelisted = bool(self.right_proxy.included_paths)
+        with self.right_proxy.batch_update():
+            self.right_proxy.set_excluded(self._right_excluded_paths)
+            if whitelisted:
                 self.right_proxy.remove_from_included(removed_files)
-                # 如果白名单被清空，则右侧显示为空目录（避免回退到整个文件夹视图）
-                if len(self.right_proxy.included_paths) == 0:
-                    try:
-                        if not self._empty_dir or not os.path.exists(self._empty_dir):
-                            self._empty_dir = tempfile.mkdtemp(prefix="rename_empty_")
-                        empty_index = self.right_proxy.mapFromSource(self.right_model.index(self._empty_dir))
-                        self.right_tree.setRootIndex(empty_index)
-                    except Exception:
-                        self.right_tree.setRootIndex(QModelIndex())
+        # 如果白名单被清空，则右侧显示为空目录（避免回退到整个文件夹视图）
+        if whitelisted and not self.right_proxy.included_paths:
+            try:
+                if not self._empty_dir or not os.path.exists(self._empty_dir):
+                    self._empty_dir = tempfile.mkdtemp(prefix="rename_empty_")
+                empty_index = self.right_proxy.mapFromSource(self.right_model.index(self._empty_dir))
+                self.right_tree.setRootIndex(empty_index)
+            except Exception:
+                self.right_tree.setRootIndex(QModelIndex())
         # 同步更新计数
         # self.update_file_count()
 
@@ -1357,10 +1839,11 @@ class FileOrganizer(QWidget):
         # 清空右侧视图（重置过滤并置空根索引）
         self._right_excluded_paths = []
         if hasattr(self, 'right_proxy'):
-            self.right_proxy.clear_excluded()
-            self.right_proxy.clear_included()
-            # 直接隐藏全部内容，避免显示驱动器列表
-            self.right_proxy.set_hide_all(False)
+            with self.right_proxy.batch_update():
+                self.right_proxy.clear_excluded()
+                self.right_proxy.clear_included()
+                # 直接隐藏全部内容，避免显示驱动器列表
+                self.right_proxy.set_hide_all(False)
         # 将右侧根设置为一个临时空目录，确保界面为空
         try:
             if not self._empty_dir or not os.path.exists(self._empty_dir):
@@ -1448,14 +1931,18 @@ class FileOrganizer(QWidget):
                     )
                     rename_data.append((folder_path, original_name, new_name))
 
-    def rename_files(self):
-        prefix = self.line_edit.currentText()
-        replace_text = (
-            # self.replace_line_edit.currentText()
-            # if self.replace_checkbox.isChecked()
-            # else None
+    def plan_visible_files(self, visible_files=None):
+        """按主窗口命名模板为右侧可见文件生成重命名计划"""
+        if visible_files is None:
+            visible_files = self.get_visible_files()
+        files = [fp for fp in visible_files if self.should_rename_file(os.path.basename(fp))]
+        options = rename_engine.RenameOptions(
+            name_template=self.line_edit.currentText(),
+            resolve_folder_case=True,
         )
-        hash_count = prefix.count("#")
+        return rename_engine.plan(files, options, snapshots=self.snapshots)
+
+    def rename_files(self):
         try:
             root_index = self.right_tree.rootIndex()
             if not root_index.isValid():
@@ -1466,37 +1953,29 @@ class FileOrganizer(QWidget):
             if not visible_files:
                 QMessageBox.information(self, "提示", "右侧没有可重命名的文件")
                 return
-            # 用可见文件列表进行重命名
-            # 将右侧根作为范围，但实际操作基于visible_files路径
-            # 逐个文件应用新名称
-            # 将可见文件按照其父目录分组，组内从0开始编号
-            from collections import defaultdict
-            folder_to_files = defaultdict(list)
-            for fp in visible_files:
-                folder_to_files[os.path.dirname(fp)].append(fp)
-            for folder_path, files in folder_to_files.items():
-                files.sort(key=self._natural_sort_key)
-                index_counter = 0
-                for file_path in files:
-                    original_name = os.path.basename(file_path)
-                    parent_folder_name = self.get_actual_cased_basename(os.path.dirname(folder_path))
-                    if self.should_rename_file(original_name):
-                        new_name = self.generate_new_name(
-                            original_name,
-                            prefix,
-                            replace_text,
-                            parent_folder_name,
-                            self.get_actual_cased_basename(folder_path),
-                            index_counter,
-                            hash_count,
-                        )
-                        index_counter += 1
-                        new_path = os.path.join(folder_path, new_name)
-                        self.perform_rename(file_path, new_path)
-
-            # 重命名完成信息提示框
-            QMessageBox.information(self, "提示", "重命名完成")
-            self.imagesRenamed.emit()  # 发送信号，通知 aebox 刷新图片列表
+            # 用可见文件列表进行重命名：按父目录分组，组内从0开始编号
+            entries = [
+                entry for entry in self.plan_visible_files(visible_files)
+                if entry[1] != entry[2]
+            ]
+            # 重新编号时新旧名称常互相占用，按依赖顺序执行，成环时借助临时名称
+            schedule = rename_apply.schedule_renames(entries, self.snapshots)
+            if schedule.failures:
+                # 目标名称重复（如规则中没有 #）等冲突在改名前一次性检查，存在冲突时不做任何修改
+                for index, reason in schedule.failures.items():
+                    print(f"Conflict renaming {entries[index][1]}: {reason}")
+                QMessageBox.information(
+                    self, "提示", f"有 {len(schedule.failures)} 个文件存在命名冲突，未进行重命名"
+                )
+                return
+
+            def on_step(src, dst, index, final, error):
+                if error is not None:
+                    print(f"Error renaming {os.path.basename(src)}: {error}")
+                elif final:
+                    print(f"Renamed {os.path.basename(src)} to {os.path.basename(dst)}")
+
+            run_schedule_with_progress(self, schedule, on_step, self.on_rename_files_finished)
         except Exception as e:
             # 重命名失败信息提示框
             QMessageBox.information(self, "提示", "重命名失败,请检查报错信息")
@@ -1504,6 +1983,80 @@ class FileOrganizer(QWidget):
         finally:
             pass
 
+    def on_rename_files_finished(self, results):
+        """重命名执行完成（可能在后台线程中执行）后提示并通知刷新"""
+        self.snapshots.invalidate()
+        if self.power_rename_window is not None:
+            self.power_rename_window.refresh_file_list()
+        cancelled = sum(1 for error in results.values() if error == rename_apply.REASON_CANCELLED)
+        failed = sum(1 for error in results.values() if error is not None) - cancelled
+        # 重命名完成信息提示框
+        if cancelled:
+            QMessageBox.information(self, "提示", f"重命名已取消，{cancelled} 个文件未重命名")
+        elif failed:
+            QMessageBox.information(self, "提示", f"重命名完成，{failed} 个文件重命名失败")
+        else:
+            QMessageBox.information(self, "提示", "重命名完成")
+        self.imagesRenamed.emit()  # 发送信号，通知 aebox 刷新图片列表
+
+    def undo_rename(self):
+        """撤销最近一次重命名"""
+        undo_last_rename(self, self.on_undo_finished)
+
+    def on_undo_finished(self, schedule, results):
+        self.snapshots.invalidate()
+        if self.power_rename_window is not None:
+            self.power_rename_window.refresh_file_list()
+        failed_count = sum(1 for error in results.values() if error is not None)
+        if failed_count:
+            QMessageBox.information(self, "提示", f"撤销完成，{failed_count} 个文件撤销失败")
+        else:
+            QMessageBox.information(self, "提示", "撤销完成")
+        self.imagesRenamed.emit()
+
+    def recover_interrupted_renames(self):
+        """根据重命名日志处理上次中断的重命名：继续执行、回滚或稍后处理"""
+        self.recover_next_interrupted(rename_journal.find_interrupted())
+
+    def recover_next_interrupted(self, states):
+        """依次处理中断的日志：上一个执行完成后才处理下一个（多个日志可能涉及同一批文件）"""
+        while states:
+            state = states.pop(0)
+            box = QMessageBox(self)
+            box.setWindowTitle("未完成的重命名")
+            box.setText(
+                f"检测到一次未完成的重命名（{state.created}，共 {state.step_count} 步）。\n"
+                "可以继续执行剩余步骤，或回滚已完成的步骤。"
+            )
+            resume_button = box.addButton("继续", QMessageBox.AcceptRole)
+            rollback_button = box.addButton("回滚", QMessageBox.DestructiveRole)
+            box.addButton("稍后", QMessageBox.RejectRole)
+            box.exec_()
+            clicked = box.clickedButton()
+            if clicked == resume_button:
+                schedule = state.pending_schedule()
+                on_done = state.mark_finished
+                # 继续执行中断的撤销时，新日志同样是撤销
+                undo_of = state.undo_of
+            elif clicked == rollback_button:
+                schedule = state.inverse_schedule()
+                on_done = state.mark_undone
+                undo_of = state.path
+            else:
+                continue
+            print(f"处理中断的重命名: {state.path}，共 {schedule.step_count()} 步")
+
+            def finished(results, on_done=on_done):
+                if rename_apply.REASON_ABORTED not in results.values():
+                    on_done()
+                failed_count = sum(1 for error in results.values() if error is not None)
+                QMessageBox.information(self, "提示", f"处理完成，失败 {failed_count} 个文件")
+                self.imagesRenamed.emit()
+                self.recover_next_interrupted(states)
+
+            run_schedule_with_progress(self, schedule, print_rename_step, finished, undo_of)
+            return
+
     def generate_new_name(
         self,
         original_name,
@@ -1514,30 +2067,11 @@ class FileOrganizer(QWidget):
         index,
         hash_count,
     ):
-        if not prefix:
-            new_name = original_name
-        else:
-            if hash_count > 0:
-                number_format = f"{{:0{hash_count}d}}"
-                new_name = prefix.replace("#" * hash_count, number_format.format(index))
-            else:
-                new_name = prefix
-
-            new_name = new_name.replace("$$p", f"{parent_folder_name}_{folder_name}")
-            new_name = new_name.replace("$p", folder_name)
-
-            file_extension = os.path.splitext(original_name)[1]
-
-            if "*" in prefix:
-                new_name += original_name
-            else:
-                new_name += file_extension
-
-            new_name = new_name.replace("*", "")
-
-            if replace_text:
-                new_name = original_name.replace(prefix, replace_text)
-
+        new_name = rename_engine.generate_template_name(
+            original_name, prefix, parent_folder_name, folder_name, index
+        )
+        if prefix and replace_text:
+            new_name = original_name.replace(prefix, replace_text)
         return new_name
 
     def perform_rename(self, original_path, new_path):
@@ -1555,56 +2089,9 @@ class FileOrganizer(QWidget):
             print(f"Error renaming {os.path.basename(original_path)}: {e}")
 
 
-    def _natural_sort_key(self, path_or_name):
-        """返回用于自然排序的键，使 '1' < '2' < '10'。
-
-        仅对末级文件名进行分段；非数字段使用小写比较以稳定排序。
-        """
-        try:
-            name = os.path.basename(path_or_name)
-        except Exception:
-            name = str(path_or_name)
-        try:
-            parts = re.split(r"(\d+)", name)
-            return [int(p) if p.isdigit() else p.lower() for p in parts]
-        except Exception:
-            return [name.lower()]
-
     def preview_rename(self):
-        rename_data = []
-        prefix = self.line_edit.currentText()
-        replace_text = (
-            # self.replace_line_edit.currentText()
-            # if self.replace_checkbox.isChecked()
-            # else None
-        )
-
-        hash_count = prefix.count("#")
-
         # 基于代理模型的可见文件进行分组预览（支持不同父目录下的多个子目录）
-        from collections import defaultdict
-        visible_files = self.get_visible_files()
-        folder_to_files = defaultdict(list)
-        for fp in visible_files:
-            folder_to_files[os.path.dirname(fp)].append(fp)
-        for folder_path, files in folder_to_files.items():
-            files.sort(key=self._natural_sort_key)
-            local_idx = 0
-            for file_path in files:
-                original_name = os.path.basename(file_path)
-                parent_folder_name = self.get_actual_cased_basename(os.path.dirname(folder_path))
-                if self.should_rename_file(original_name):
-                    new_name = self.generate_new_name(
-                        original_name,
-                        prefix,
-                        replace_text,
-                        parent_folder_name,
-                        self.get_actual_cased_basename(folder_path),
-                        local_idx,
-                        hash_count,
-                    )
-                    rename_data.append((folder_path, original_name, new_name))
-                    local_idx += 1
+        rename_data = list(self.plan_visible_files())
 
         if rename_data:
             dialog = PreviewDialog(rename_data)
@@ -1625,36 +2112,44 @@ class FileOrganizer(QWidget):
             QMessageBox.information(self, "提示", "右侧没有可重命名的文件")
             return
         
-        # 检查是否已经存在PowerRename窗口
-        if self.power_rename_window is not None and not self.power_rename_window.isHidden():
-            # 如果窗口已存在且可见，只更新文件列表
-            self.power_rename_window.file_list = visible_files
-            self.power_rename_window.show_original_files()
-            self.power_rename_window.raise_()
-            self.power_rename_window.activateWindow()
-            return
-            
-        # 打开PowerRename窗口
-        # 以无父窗口显示，避免带出主窗口
-        self.power_rename_window = PowerRenameDialog(visible_files, None)
-        self.power_rename_window.setWindowFlags(Qt.Window | Qt.WindowStaysOnTopHint)
-        self.power_rename_window.show()
-        
-        # 连接窗口关闭信号
-        self.power_rename_window.window_closed.connect(self.on_power_rename_closed)
+        # 以无父窗口显示，避免带出主窗口；窗口已打开时只更新文件列表
+        self._show_power_rename(visible_files)
 
-    def _collect_files_recursive(self, paths):
-        files = []
-        for p in paths:
-            if os.path.isfile(p):
-                files.append(p)
-            elif os.path.isdir(p):
-                for dirpath, dirnames, filenames in os.walk(p):
-                    for name in filenames:
-                        fp = os.path.join(dirpath, name)
-                        if os.path.isfile(fp):
-                            files.append(fp)
-        return files
+    def _stream_files_recursive(self, paths):
+        """返回 paths 下文件的批次迭代器，供 PowerRenameDialog.load_files 流式载入。
+
+        只同步扫描到第一批文件为止（用于判断是否为空），没有任何文件时返回 None。
+        """
+        batches = rename_fs.iter_file_batches(paths)
+        first = next(batches, None)
+        if first is None:
+            return None
+
+        def stream():
+            try:
+                yield first
+                yield from batches
+            finally:
+                batches.close()
+
+        return stream()
+
+    def _show_power_rename(self, files=None, batches=None, parent=None):
+        """在 PowerRename 窗口中显示文件列表 files，或流式载入 batches；窗口已打开时复用"""
+        window = self.power_rename_window
+        if window is None or window.isHidden():
+            window = PowerRenameDialog([], parent)
+            window.setWindowFlags(Qt.Window | Qt.WindowStaysOnTopHint)
+            window.window_closed.connect(self.on_power_rename_closed)
+            self.power_rename_window = window
+            window.show()
+        else:
+            window.raise_()
+            window.activateWindow()
+        if batches is not None:
+            window.load_files(batches)
+        else:
+            window.set_files(files)
 
     def _get_explorer_selected_paths(self):
         """使用 oleacc(MSAA) 为主方案获取资源管理器选中项；失败回退 COM。"""
@@ -1917,18 +2412,19 @@ class FileOrganizer(QWidget):
         """优先使用资源管理器选中项；否则回退左侧选择；再否则用右侧可见文件。"""
         try:
             paths = self._get_explorer_selected_paths()
-            files = []
+            # 目录树较大时在后台流式载入，窗口先显示已找到的文件
+            batches = None
             if paths:
                 try:
                     print(f"[Ctrl+M] explorer selected paths: {len(paths)}")
                 except Exception:
                     pass
-                files = self._collect_files_recursive(paths)
+                batches = self._stream_files_recursive(paths)
                 # 同步把资源管理器选择应用到主程序右侧视图
                 self._apply_paths_to_right(paths)
                 # 同步定位左侧文件树到传入的文件夹
                 self._sync_left_tree_to_paths(paths)
-            if not files:
+            if batches is None:
                 # 回退：左侧选择
                 selected = [idx for idx in self.left_tree.selectedIndexes() if idx.column() == 0]
                 if selected:
@@ -1937,40 +2433,23 @@ class FileOrganizer(QWidget):
                         print(f"[Ctrl+M] fallback left selection count: {len(left_paths)}")
                     except Exception:
                         pass
-                    files = self._collect_files_recursive(left_paths)
+                    batches = self._stream_files_recursive(left_paths)
                     self._apply_paths_to_right(left_paths)
                     # 同步定位左侧文件树到传入的文件夹
                     self._sync_left_tree_to_paths(left_paths)
-            if not files:
-                # 再回退：右侧可见
-                files = self.get_visible_files()
-                try:
-                    print(f"[Ctrl+M] fallback visible files count: {len(files)}")
-                except Exception:
-                    pass
-            if not files:
-                QMessageBox.information(self, "提示", "没有可重命名的文件")
+            if batches is not None:
+                self._show_power_rename(batches=batches)
                 return
-            files = sorted(list(dict.fromkeys(files)), key=self._natural_sort_key)
+            # 再回退：右侧可见
+            files = self.get_visible_files()
             try:
-                print(f"[Ctrl+M] final files count opened in PowerRename: {len(files)}")
+                print(f"[Ctrl+M] fallback visible files count: {len(files)}")
             except Exception:
                 pass
-            
-            # 检查是否已经存在PowerRename窗口
-            if self.power_rename_window is not None and not self.power_rename_window.isHidden():
-                # 如果窗口已存在且可见，只更新文件列表
-                self.power_rename_window.file_list = files
-                self.power_rename_window.show_original_files()
-                self.power_rename_window.raise_()
-                self.power_rename_window.activateWindow()
+            if not files:
+                QMessageBox.information(self, "提示", "没有可重命名的文件")
                 return
-            
-            # 创建新的PowerRename窗口
-            self.power_rename_window = PowerRenameDialog(files, None)
-            self.power_rename_window.setWindowFlags(Qt.Window | Qt.WindowStaysOnTopHint)
-            self.power_rename_window.show()
-            self.power_rename_window.window_closed.connect(self.on_power_rename_closed)
+            self._show_power_rename(files)
         except Exception as e:
             print(f"open_power_rename_from_explorer_or_fallback error: {e}")
 
@@ -2025,35 +2504,11 @@ class FileOrganizer(QWidget):
                 QMessageBox.information(self, "提示", "请在左侧选择文件或文件夹")
                 return
             paths = [self.left_model.filePath(idx) for idx in selected]
-            files = []
-            for p in paths:
-                if os.path.isfile(p):
-                    files.append(p)
-                elif os.path.isdir(p):
-                    for dirpath, dirnames, filenames in os.walk(p):
-                        for name in filenames:
-                            fp = os.path.join(dirpath, name)
-                            if os.path.isfile(fp):
-                                files.append(fp)
-            if not files:
+            batches = self._stream_files_recursive(paths)
+            if batches is None:
                 QMessageBox.information(self, "提示", "所选路径下没有可重命名的文件")
                 return
-            # 去重并自然排序
-            files = sorted(list(dict.fromkeys(files)), key=self._natural_sort_key)
-            
-            # 检查是否已经存在PowerRename窗口
-            if self.power_rename_window is not None and not self.power_rename_window.isHidden():
-                # 如果窗口已存在且可见，只更新文件列表
-                self.power_rename_window.file_list = files
-                self.power_rename_window.show_original_files()
-                self.power_rename_window.raise_()
-                self.power_rename_window.activateWindow()
-                return
-            
-            self.power_rename_window = PowerRenameDialog(files, self)
-            self.power_rename_window.setWindowFlags(Qt.Window | Qt.WindowStaysOnTopHint)
-            self.power_rename_window.show()
-            self.power_rename_window.window_closed.connect(self.on_power_rename_closed)
+            self._show_power_rename(batches=batches, parent=self)
         except Exception as e:
             print(f"open_power_rename_from_left_selection error: {e}")
         
@@ -2067,41 +2522,18 @@ class FileOrganizer(QWidget):
         visible_files = []
         # 优先基于白名单直接遍历文件系统，避免必须点击展开目录才加载
         included_paths = getattr(self.right_proxy, "included_paths", set())
-        excluded_paths = set(getattr(self, "_right_excluded_paths", []))
+        # 排除路径编译为前缀树，每次判断只需 O(路径深度)
+        excluded = rename_fs.PathTrie(
+            rename_fs.normalize_path(p) for p in getattr(self, "_right_excluded_paths", [])
+        )
+        normalize = rename_fs.normalize_path
 
         def is_excluded(path):
-            try:
-                norm = os.path.normcase(os.path.normpath(path))
-            except Exception:
-                norm = path
-            for p in excluded_paths:
-                if norm == p or norm.startswith(p + os.sep):
-                    return True
-            return False
+            return bool(excluded) and excluded.covers(normalize(path))
 
         if included_paths:
-            # 将代理模型保存的规范化路径还原为实际路径进行遍历
-            for p in list(included_paths):
-                try:
-                    # included_paths 已是规范化过的大小写无关路径，这里尽量获取真实存在的路径
-                    path = p
-                    if os.path.isfile(path):
-                        if not is_excluded(path):
-                            visible_files.append(path)
-                    elif os.path.isdir(path):
-                        for dirpath, dirnames, filenames in os.walk(path):
-                            # 应用排除规则到目录层级（剪枝）
-                            if is_excluded(dirpath):
-                                # 跳过该目录的后代
-                                dirnames[:] = []
-                                continue
-                            for name in filenames:
-                                fp = os.path.join(dirpath, name)
-                                if not is_excluded(fp) and os.path.isfile(fp):
-                                    visible_files.append(fp)
-                except Exception:
-                    continue
-            return visible_files
+            # included_paths 已是规范化过的大小写无关路径，直接遍历；被排除的目录不会进入
+            return rename_fs.walk_files(list(included_paths), excluded)
 
         # 回退：无白名单时，按当前树可见范围遍历（保持原行为）
         root_index = self.right_tree.rootIndex()
@@ -2124,26 +2556,8 @@ class FileOrganizer(QWidget):
         return visible_files
 
     def get_actual_cased_basename(self, path):
-        """在 Windows 上返回路径末级名称的实际大小写；其他平台直接返回 basename。
-
-        通过枚举父目录，对比不区分大小写名称以获取真实的条目名称。
-        """
-        try:
-            parent_dir = os.path.dirname(path)
-            target = os.path.basename(path)
-            if not parent_dir or not target:
-                return target
-            if not os.path.isdir(parent_dir):
-                return target
-            try:
-                for entry in os.listdir(parent_dir):
-                    if entry.lower() == target.lower():
-                        return entry
-            except Exception:
-                return target
-            return target
-        except Exception:
-            return os.path.basename(path)
+        """在 Windows 上返回路径末级名称的实际大小写；其他平台直接返回 basename。"""
+        return rename_engine.actual_cased_basename(path, self.snapshots)
 
     def show_help(self):
         help_text = (
@@ -2239,15 +2653,16 @@ class FileOrganizer(QWidget):
             target_path = os.path.normpath(target_path)
             # 设置右侧根和白名单
             self._right_excluded_paths = []
-            self.right_proxy.clear_excluded()
-            self.right_proxy.set_hide_all(False)
             if os.path.isfile(target_path):
                 include_set = {target_path}
                 root_dir = os.path.dirname(target_path)
             else:
                 include_set = {target_path}
                 root_dir = target_path
-            self.right_proxy.set_included(include_set)
+            with self.right_proxy.batch_update():
+                self.right_proxy.clear_excluded()
+                self.right_proxy.set_hide_all(False)
+                self.right_proxy.set_included(include_set)
             self.right_tree.setRootIndex(self.right_proxy.mapFromSource(self.right_model.index(root_dir)))
             # 打开 PowerRename
             self.open_power_rename()
@@ -2286,14 +2701,14 @@ class FileOrganizer(QWidget):
                 print(f"[_apply_paths_to_right] include={len(include)}, root={root_dir}")
             except Exception:
                 pass
-            # 应用到右侧代理
+            # 应用到右侧代理（所有修改只刷新一次过滤）
             self._right_excluded_paths = []
-            self.right_proxy.clear_excluded()
-            self.right_proxy.set_hide_all(False)
-            self.right_proxy.set_included(include)
+            with self.right_proxy.batch_update():
+                self.right_proxy.clear_excluded()
+                self.right_proxy.set_hide_all(False)
+                self.right_proxy.set_included(include)
             if root_dir:
                 self.right_tree.setRootIndex(self.right_proxy.mapFromSource(self.right_model.index(root_dir)))
-            self.right_proxy.invalidate()
         except Exception as e:
             print(f"_apply_paths_to_right error: {e}")
 
@@ -0,0 +1,352 @@
+"""应用重命名（不依赖 Qt）：排序规划与执行。
+
+重命名前先在内存中为每个文件夹建立 旧名 -> 新名 的依赖关系：
+目标名被另一个待改名文件占用时，先改那个文件；形成环（如互换、整体顺延编号）
+时用临时名称打断。规划完成后才开始操作磁盘。
+
+互不相关的链可以并行执行：网络共享上每次重命名都是一次往返，
+用有限大小的线程池同时发出多个请求能显著缩短总耗时。
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import rename_fs
+
+
+# 错误原因（与 PowerRenameDialog 中的提示保持一致）
+REASON_SOURCE_MISSING = "原文件不存在"
+REASON_TARGET_EXISTS = "目标文件已存在"
+REASON_DUPLICATE_TARGET = "目标名称重复"
+REASON_CANCELLED = "已取消"
+REASON_ABORTED = "执行中断"
+
+# 并行执行时每个任务包含的步骤数（按整条链打包）
+BATCH_STEPS = 32
+
+
+def default_case_insensitive():
+    """当前平台的文件名是否不区分大小写"""
+    return os.name == 'nt'
+
+
+def fold_name(name, case_insensitive):
+    """返回用于比较的文件名键"""
+    return name.lower() if case_insensitive else name
+
+
+def rename_no_replace(src, dst):
+    """重命名但不覆盖已有文件。
+
+    Windows 上 os.rename 本身不会覆盖；其他平台先检查目标，
+    目标与源是同一文件（大小写不敏感的文件系统上仅改大小写）时允许。
+    """
+    if os.name != 'nt' and os.path.lexists(dst):
+        try:
+            same = os.path.samestat(os.lstat(src), os.lstat(dst))
+        except OSError:
+            same = False
+        if not same:
+            raise FileExistsError(f"{REASON_TARGET_EXISTS}: {dst}")
+    os.rename(src, dst)
+
+
+class RenameSchedule:
+    """重命名执行计划。
+
+    entries 为待重命名的 (folder, old_name, new_name)；
+    steps 为 {folder: [chain, ...]}，chain 为 [(src_path, dst_path, entry_index, final), ...]，
+    链内须按顺序执行，不同链之间互不影响；final 为 False 的步骤是移到临时名称。
+    failures 为规划阶段即确定失败的 {entry_index: 原因}。
+    """
+
+    def __init__(self, entries):
+        self.entries = list(entries)
+        self.steps = {}
+        self.failures = {}
+
+    def step_count(self):
+        return sum(len(chain) for chains in self.steps.values() for chain in chains)
+
+    def chains(self):
+        """依次返回所有文件夹中的链"""
+        for chains in self.steps.values():
+            yield from chains
+
+
+def _temp_name(old_name, taken, case_insensitive):
+    """在文件夹内生成一个不与现有名称或目标名称冲突的临时名称"""
+    n = 0
+    while True:
+        candidate = f"{old_name}.~rename{n}"
+        key = fold_name(candidate, case_insensitive)
+        if key not in taken:
+            taken.add(key)
+            return candidate
+        n += 1
+
+
+def _validate_folder(entries, indexes, snapshot, case_insensitive, failures):
+    """在内存中检查一个文件夹内的条目，失败写入 failures，返回依赖关系与现有名称。
+
+    依赖关系 dep[i] = j 表示 i 的目标当前被 j 的源文件占用，j 须先改名；
+    目标空闲（或仅大小写不同的改名）时 dep[i] 为 None。
+    existing 为文件夹中现有名称的比较键集合，只遍历一次内存中的名称，不访问磁盘。
+    """
+    existing = set()
+    if snapshot is not None:
+        existing = {fold_name(name, case_insensitive) for name in snapshot.entries}
+
+    # 源文件键 -> 条目序号
+    sources = {}
+    for i in indexes:
+        old_name = entries[i][1]
+        key = fold_name(old_name, case_insensitive)
+        if key not in existing:
+            failures[i] = REASON_SOURCE_MISSING
+            continue
+        sources[key] = i
+
+    # 目标重复的条目全部失败
+    target_count = {}
+    for i in sources.values():
+        key = fold_name(entries[i][2], case_insensitive)
+        target_count[key] = target_count.get(key, 0) + 1
+
+    dep = {}
+    for key, i in sources.items():
+        target_key = fold_name(entries[i][2], case_insensitive)
+        if target_count[target_key] > 1:
+            failures[i] = REASON_DUPLICATE_TARGET
+        elif target_key == key:
+            # 仅大小写不同的改名，目标就是自身
+            dep[i] = None
+        elif target_key in sources:
+            dep[i] = sources[target_key]
+        elif target_key in existing:
+            failures[i] = REASON_TARGET_EXISTS
+        else:
+            dep[i] = None
+
+    # 依赖的文件无法改名时，目标仍被占用，沿链传播失败（每个节点只判断一次）
+    resolved = {}
+    for i in list(dep):
+        if i in resolved:
+            continue
+        chain = []
+        on_chain = set()
+        j = i
+        while True:
+            if j is None or j in on_chain:
+                ok = True  # 链尾目标空闲，或成环
+                break
+            if j in resolved:
+                ok = resolved[j]
+                break
+            if j not in dep:
+                ok = False  # 依赖的条目已失败
+                break
+            chain.append(j)
+            on_chain.add(j)
+            j = dep[j]
+        for k in chain:
+            resolved[k] = ok
+            if not ok:
+                failures[k] = REASON_TARGET_EXISTS
+                del dep[k]
+    return dep, existing
+
+
+def _group_indexes(entries):
+    """按文件夹分组条目序号，跳过新旧名称相同的条目"""
+    by_folder = {}
+    for i, (folder, old_name, new_name) in enumerate(entries):
+        if old_name != new_name:
+            by_folder.setdefault(folder, []).append(i)
+    return by_folder
+
+
+def find_conflicts(entries, snapshots=None, case_insensitive=None):
+    """检查 (folder, old_name, new_name) 列表中的冲突，返回 {entry_index: 原因}。
+
+    假设所有新旧名称不同的条目都会被重命名；每个文件夹取一次快照，
+    之后只在内存中比较现有名称与新名称（按需忽略大小写）。
+    """
+    if snapshots is None:
+        snapshots = rename_fs.SnapshotCache()
+    if case_insensitive is None:
+        case_insensitive = default_case_insensitive()
+    failures = {}
+    for folder, indexes in _group_indexes(entries).items():
+        _validate_folder(entries, indexes, snapshots.get(folder), case_insensitive, failures)
+    return failures
+
+
+def _schedule_folder(schedule, folder, indexes, snapshot, case_insensitive):
+    entries = schedule.entries
+    dep, existing = _validate_folder(entries, indexes, snapshot, case_insensitive, schedule.failures)
+
+    taken = set(existing)
+    taken.update(fold_name(entries[i][2], case_insensitive) for i in dep)
+
+    chains = []
+    # 节点 -> 所在的链
+    chain_of = {}
+
+    def emit(i):
+        old_name, new_name = entries[i][1], entries[i][2]
+        steps.append((os.path.join(folder, old_name), os.path.join(folder, new_name), i, True))
+
+    # 依赖关系中每个节点至多一个出边、一个入边：只有链和环
+    state = {}
+    for start in dep:
+        if state.get(start):
+            continue
+        path = []
+        node = start
+        while node is not None and not state.get(node):
+            state[node] = 1
+            path.append(node)
+            node = dep[node]
+        if node is not None and state[node] == 2:
+            # 目标被已生成的链的起点占用：须在那条链执行完之后执行，放进同一条链
+            steps = chain_of[node]
+        else:
+            steps = []
+            chains.append(steps)
+        for i in path:
+            chain_of[i] = steps
+        if node is not None and state[node] == 1:
+            # 成环：先把 node 移到临时名称，再倒序执行环内其余改名，最后从临时名称改到目标
+            cut = path.index(node)
+            old_name, new_name = entries[node][1], entries[node][2]
+            temp_path = os.path.join(folder, _temp_name(old_name, taken, case_insensitive))
+            steps.append((os.path.join(folder, old_name), temp_path, node, False))
+            for i in reversed(path[cut + 1:]):
+                emit(i)
+            steps.append((temp_path, os.path.join(folder, new_name), node, True))
+            for i in reversed(path[:cut]):
+                emit(i)
+        else:
+            for i in reversed(path):
+                emit(i)
+        for i in path:
+            state[i] = 2
+
+    if chains:
+        schedule.steps[folder] = chains
+
+
+def schedule_renames(entries, snapshots=None, case_insensitive=None):
+    """为 (folder, old_name, new_name) 列表生成 RenameSchedule，仅在内存中计算。
+
+    snapshots 为 rename_fs.SnapshotCache，用于确定各文件夹中现有的名称。
+    """
+    if snapshots is None:
+        snapshots = rename_fs.SnapshotCache()
+    if case_insensitive is None:
+        case_insensitive = default_case_insensitive()
+    schedule = RenameSchedule(entries)
+    for folder, indexes in _group_indexes(schedule.entries).items():
+        _schedule_folder(schedule, folder, indexes, snapshots.get(folder), case_insensitive)
+    return schedule
+
+
+def run_steps(steps, on_step=None):
+    """按顺序执行一条链中的步骤，返回 {entry_index: 错误信息或 None}。
+
+    某一步失败后，之后以其源文件为目标的步骤会被跳过，避免覆盖。
+    """
+    results = {}
+    blocked = set()
+    for src, dst, index, final in steps:
+        if index in results:
+            continue
+        if os.path.normcase(dst) in blocked:
+            error = REASON_TARGET_EXISTS
+        else:
+            try:
+                rename_no_replace(src, dst)
+                error = None
+            except OSError as e:
+                error = str(e)
+        if error is not None:
+            results[index] = error
+            blocked.add(os.path.normcase(src))
+        elif final:
+            results[index] = None
+        if on_step is not None:
+            on_step(src, dst, index, final, error)
+    return results
+
+
+def _batches(schedule, batch_steps=BATCH_STEPS):
+    """把链打包成任务，每个任务至少包含 batch_steps 步（链不会被拆开）"""
+    batch = []
+    size = 0
+    for chain in schedule.chains():
+        batch.append(chain)
+        size += len(chain)
+        if size >= batch_steps:
+            yield batch
+            batch = []
+            size = 0
+    if batch:
+        yield batch
+
+
+def resolve_paths(schedule, results):
+    """根据执行结果返回路径变化 {原路径: 现路径}，现路径为 None 表示文件已找不到。
+
+    成功的条目直接取新路径；只对失败的条目检查磁盘：原文件仍在时不记录，
+    环中途失败时文件可能停在临时名称上。
+    """
+    temp_paths = {}
+    for chain in schedule.chains():
+        for src, dst, index, final in chain:
+            if not final:
+                temp_paths[index] = dst
+    paths = {}
+    for index, (folder, old_name, new_name) in enumerate(schedule.entries):
+        old_path = os.path.join(folder, old_name)
+        if results.get(index, REASON_SOURCE_MISSING) is None:
+            paths[old_path] = os.path.join(folder, new_name)
+        elif not os.path.lexists(old_path):
+            temp_path = temp_paths.get(index)
+            paths[old_path] = temp_path if temp_path and os.path.lexists(temp_path) else None
+    return paths
+
+
+def run_schedule(schedule, on_step=None, max_workers=1, cancel_check=None):
+    """执行计划，返回 {entry_index: 错误信息或 None}（包含规划阶段的失败）。
+
+    max_workers 大于 1 时用线程池并行执行互不相关的链，on_step 回调会被加锁串行调用；
+    cancel_check() 返回 True 后不再开始新的链（已开始的链会执行完，不会留下临时名称），
+    未执行的条目记为 REASON_CANCELLED。
+    """
+    results = dict(schedule.failures)
+    if on_step is not None and max_workers > 1:
+        lock = threading.Lock()
+        callback = on_step
+
+        def on_step(*args):
+            with lock:
+                callback(*args)
+
+    def run_batch(chains):
+        batch_results = {}
+        for chain in chains:
+            if cancel_check is not None and cancel_check():
+                for src, dst, index, final in chain:
+                    batch_results.setdefault(index, REASON_CANCELLED)
+                continue
+            batch_results.update(run_steps(chain, on_step))
+        return batch_results
+
+    if max_workers > 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            for batch_results in pool.map(run_batch, _batches(schedule)):
+                results.update(batch_results)
+    else:
+        results.update(run_batch(schedule.chains()))
+    return results
@@ -0,0 +1,820 @@
+"""重命名规划引擎（不依赖 Qt）。
+
+PowerRenameDialog 与 FileOrganizer 都通过 plan(files, options) 计算新文件名，
+因此也可以在脚本中直接批量调用或单独做性能分析。
+"""
+import os
+import re
+import datetime
+import functools
+import unicodedata
+
+import rename_apply
+import rename_fs
+import rename_meta
+
+
+# 文本格式：与 PowerRenameDialog 中的 aa / AA / Aa / Aa Aa 按钮对应
+TEXT_FORMATS = ("lower", "upper", "capitalize", "title")
+
+
+class RenameError(ValueError):
+    """查找/替换规则无效（如正则表达式错误），整个预览无法计算"""
+
+
+class RenameOptions:
+    """重命名选项，纯数据对象，可在任意线程中使用。
+
+    - 查找/替换模式（PowerRename）：search_text / replace_text 及各开关；
+    - 命名模板模式（主窗口“开始/预览”）：设置 name_template，如 `$p_*`、`#_*`。
+    """
+
+    def __init__(
+        self,
+        search_text="",
+        replace_text="",
+        use_regex=False,
+        match_all=False,
+        case_sensitive=False,
+        include_files=True,
+        include_folders=False,
+        include_subfolders=False,
+        text_format=None,
+        name_template=None,
+        resolve_folder_case=False,
+    ):
+        self.search_text = search_text or ""
+        self.replace_text = replace_text or ""
+        self.use_regex = bool(use_regex)
+        self.match_all = bool(match_all)
+        self.case_sensitive = bool(case_sensitive)
+        self.include_files = bool(include_files)
+        # 目前仅文件参与重命名，以下两项保留给界面使用
+        self.include_folders = bool(include_folders)
+        self.include_subfolders = bool(include_subfolders)
+        self.text_format = text_format if text_format in TEXT_FORMATS else None
+        self.name_template = name_template
+        # 为 True 时 $p/$$p 使用磁盘上的实际大小写
+        self.resolve_folder_case = bool(resolve_folder_case)
+
+
+class RenamePlan:
+    """重命名计划：按文件夹分组、组内自然排序后的 (folder, old_name, new_name) 列表。
+
+    changed_mask 与条目对齐，新旧名称不同的条目为 1，供界面增量统计使用；
+    conflicts 为 {条目序号: 原因}，记录应用前即可确定会失败的条目（如目标名称重复）。
+    """
+
+    def __init__(self, entries=None, changed_mask=None, conflicts=None):
+        self.entries = list(entries or [])
+        if changed_mask is None:
+            changed_mask = bytearray(e[1] != e[2] for e in self.entries)
+        self.changed_mask = changed_mask
+        self.conflicts = conflicts or {}
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, index):
+        return self.entries[index]
+
+
+class SelectionState:
+    """预览行的勾选状态，按稳定的文件 id 保存在 bytearray 中。
+
+    路径第一次出现时分配 id（默认勾选）；文件被重命名后用 rename_path 把 id
+    转移到新路径，因此列表重新排序或刷新后勾选状态不会错位。
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self.bits = bytearray()
+
+    def __len__(self):
+        return len(self.bits)
+
+    def id_for(self, path):
+        """返回路径对应的文件 id，不存在时分配新 id"""
+        file_id = self._ids.get(path)
+        if file_id is None:
+            file_id = len(self.bits)
+            self._ids[path] = file_id
+            self.bits.append(1)
+        return file_id
+
+    def is_checked(self, file_id):
+        return self.bits[file_id] == 1
+
+    def set_checked(self, file_id, flag):
+        self.bits[file_id] = 1 if flag else 0
+
+    def set_all(self, flag):
+        """全选/全不选：整体覆盖位图，不逐个遍历"""
+        self.bits[:] = (b"\x01" if flag else b"\x00") * len(self.bits)
+
+    def rename_path(self, old_path, new_path):
+        """文件重命名后，让新路径沿用原路径的 id 与勾选状态"""
+        self.rename_paths({old_path: new_path})
+
+    def rename_paths(self, paths):
+        """按 {原路径: 新路径} 批量转移 id。
+
+        先取出所有原路径的 id 再统一分配，链式改名（a->b、b->c）或成环时
+        不会在 b 移走之前就覆盖它的 id。
+        """
+        moved = []
+        for old_path, new_path in paths.items():
+            file_id = self._ids.pop(old_path, None)
+            if file_id is not None:
+                moved.append((new_path, file_id))
+        for new_path, file_id in moved:
+            self._ids[new_path] = file_id
+
+    def clear(self):
+        self._ids.clear()
+        self.bits = bytearray()
+
+
+class _CharSortKeys(dict):
+    """字符 -> 排序用的编码（str.translate 的映射表，按需填充）。
+
+    规则接近资源管理器的逻辑排序（StrCmpLogicalW）：符号/空白 < 数字 < 字母，
+    字母不区分大小写，带重音的字母排在对应的基本字母处；数字保持原样，另行处理。
+    """
+
+    def __missing__(self, code):
+        ch = chr(code)
+        if "0" <= ch <= "9":
+            value = ch
+        elif ch.isalpha():
+            value = "\x03" + unicodedata.normalize("NFKD", ch)[0].lower()
+        else:
+            value = "\x01" + ch
+        self[code] = value
+        return value
+
+
+_CHAR_SORT_KEYS = _CharSortKeys()
+_DIGITS_RE = re.compile(r"[0-9]+")
+
+
+def _number_sort_key(match):
+    # 数字段：先比较有效位数，再逐位比较；前导零只在最后的原文件名比较中起作用
+    digits = match.group().lstrip("0") or "0"
+    return "\x02" + chr(0x20 + len(digits)) + digits
+
+
+def natural_sort_key(path_or_name):
+    """返回用于自然排序的键（字符串），使 '1' < '2' < '10'。
+
+    仅对末级文件名排序，数字段按数值比较，其余规则见 _CharSortKeys；
+    除此之外完全相同时按原文件名区分，保证顺序确定。
+    """
+    try:
+        name = os.path.basename(path_or_name)
+    except Exception:
+        name = str(path_or_name)
+    return _name_sort_key(name)
+
+
+def _name_sort_key(name):
+    return _DIGITS_RE.sub(_number_sort_key, name.translate(_CHAR_SORT_KEYS)) + "\x00" + name
+
+
+class FileList:
+    """去重、保持载入顺序的文件列表，载入时为每个文件计算一次自然排序键。
+
+    按文件夹分组、组内排序的结果会缓存到列表变化为止，
+    连续预览（如逐字输入查找文本）时不再重复排序。
+    """
+
+    def __init__(self, files=(), sort_keys=None):
+        # 路径 -> 自然排序键（按载入顺序）
+        self.sort_keys = {}
+        # 文件夹 -> [(排序键, 路径), ...]
+        self._groups = {}
+        # 文件夹 -> 排好序的路径列表；列表变化时删除对应文件夹
+        self._paths = {}
+        self._order = None
+        self.extend(files, sort_keys)
+
+    def __len__(self):
+        return len(self.sort_keys)
+
+    def __iter__(self):
+        return iter(self.sort_keys)
+
+    def __contains__(self, path):
+        return path in self.sort_keys
+
+    def extend(self, files, sort_keys=None):
+        """追加文件（跳过已有的），返回新增的数量；sort_keys 为可复用的 {路径: 排序键}"""
+        keys = self.sort_keys
+        groups = self._groups
+        count = len(keys)
+        for path in files:
+            if path in keys:
+                continue
+            folder, name = os.path.split(path)
+            key = sort_keys.get(path) if sort_keys else None
+            if key is None:
+                key = _name_sort_key(name)
+            keys[path] = key
+            group = groups.get(folder)
+            if group is None:
+                group = groups[folder] = []
+            group.append((key, path))
+            self._paths.pop(folder, None)
+        added = len(keys) - count
+        if added:
+            self._order = None
+        return added
+
+    def copy(self):
+        """返回副本（分组排序结果一并复制），可交给后台线程使用"""
+        self.groups()
+        other = FileList()
+        other.sort_keys = dict(self.sort_keys)
+        other._groups = {folder: list(group) for folder, group in self._groups.items()}
+        other._paths = dict(self._paths)
+        other._order = self._order
+        return other
+
+    def groups(self):
+        """返回 [(文件夹, [路径, ...]), ...]：文件夹按其中排在最前的文件排序，组内自然排序。
+
+        返回的路径列表会被缓存复用，调用方不应修改。
+        """
+        groups = self._groups
+        paths = self._paths
+        for folder, group in groups.items():
+            if folder not in paths:
+                group.sort()
+                paths[folder] = [path for _, path in group]
+        if self._order is None:
+            self._order = sorted(groups, key=lambda folder: groups[folder][0][0])
+        return [(folder, paths[folder]) for folder in self._order]
+
+
+# 长时间计算中检查取消请求的间隔（文件数）
+_CANCEL_CHECK_INTERVAL = 1024
+# 同一目录中待检查的文件达到该数量（或该目录已有快照）时，用目录快照代替逐个 isfile
+SNAPSHOT_MIN_FILES = 16
+
+
+def group_by_folder(files, cancel_check=None, snapshots=None):
+    """按文件夹分组（自然排序后），返回 [(folder_path, [file_path, ...]), ...]。
+
+    files 为 FileList 时直接使用其缓存的分组排序结果。
+    不存在或不是文件的路径会被跳过；cancel_check() 返回 True 时中止并返回 None。
+    snapshots 为 rename_fs.SnapshotCache，未提供时使用本次调用内的临时缓存。
+    """
+    if snapshots is None:
+        snapshots = rename_fs.SnapshotCache()
+    if not isinstance(files, FileList):
+        files = FileList(files)
+
+    result = []
+    for folder_path, group in files.groups():
+        if cancel_check is not None and cancel_check():
+            return None
+        if len(group) >= SNAPSHOT_MIN_FILES or snapshots.cached(folder_path):
+            snapshot = snapshots.get(folder_path)
+            if snapshot is None:
+                continue
+            is_file = snapshot.is_file
+            group = [fp for fp in group if is_file(os.path.basename(fp))]
+        else:
+            group = [fp for fp in group if os.path.isfile(fp)]
+        if group:
+            result.append((folder_path, group))
+    return result
+
+
+def actual_cased_basename(path, snapshots=None):
+    """在 Windows 上返回路径末级名称的实际大小写；其他平台直接返回 basename。
+
+    通过父目录的快照，对比不区分大小写名称以获取真实的条目名称；
+    snapshots 为 rename_fs.SnapshotCache，同一目录只扫描一次。
+    """
+    try:
+        parent_dir = os.path.dirname(path)
+        target = os.path.basename(path)
+        if not parent_dir or not target:
+            return target
+        if snapshots is None:
+            snapshots = rename_fs.SnapshotCache()
+        snapshot = snapshots.get(parent_dir)
+        if snapshot is None:
+            return target
+        return snapshot.actual_name(target) or target
+    except Exception:
+        return os.path.basename(path)
+
+
+def format_text(text, text_format):
+    """按文本格式（lower/upper/capitalize/title）转换文本"""
+    if text_format == "lower":
+        return text.lower()
+    elif text_format == "upper":
+        return text.upper()
+    elif text_format == "capitalize":
+        return text.capitalize()
+    elif text_format == "title":
+        return text.title()
+    return text
+
+
+def case_insensitive_replace(text, search_text, replace_text, replace_all=True):
+    """不区分大小写的字符串替换。
+
+    在小写文本中从左到右查找不重叠的匹配，一次拼接出结果；
+    小写后长度会变化的字符（如 İ）通过位置映射还原到原文本，
+    只接受落在完整字符边界上的匹配。
+    """
+    if not search_text:
+        return text
+
+    search_lower = search_text.lower()
+    text_lower = text.lower()
+
+    # 小写后长度不变时位置一一对应；否则记录每个字符在小写文本中的起点
+    boundaries = None
+    if len(text_lower) != len(text):
+        boundaries = {}
+        lowered_pos = 0
+        for i, ch in enumerate(text):
+            boundaries[lowered_pos] = i
+            lowered_pos += len(ch.lower())
+        boundaries[lowered_pos] = len(text)
+
+    chunks = []
+    last = 0  # 原文本中已输出到的位置
+    start = 0  # 小写文本中的查找起点
+    search_len = len(search_lower)
+    while True:
+        pos = text_lower.find(search_lower, start)
+        if pos == -1:
+            break
+        if boundaries is None:
+            begin, end = pos, pos + search_len
+        else:
+            begin = boundaries.get(pos)
+            end = boundaries.get(pos + search_len)
+            if begin is None or end is None:
+                # 匹配落在某个字符小写展开的中间，跳过
+                start = pos + 1
+                continue
+        chunks.append(text[last:begin])
+        chunks.append(replace_text)
+        last = end
+        start = pos + search_len
+        if not replace_all:
+            break
+
+    if not chunks:
+        return text
+    chunks.append(text[last:])
+    return "".join(chunks)
+
+
+# 替换模板中的特殊占位符：图片元数据（$width、$height、$camera）、
+# 拍摄/修改/创建时间（$e / $m / $c 加 YYYY、MM、DD、hh、mm、ss，区分大小写）、
+# 当前日期、#=N 起始序号、# 序号、$$p/$$P 两级文件夹、$p 文件夹
+_TOKEN_RE = re.compile(
+    r"\$(?P<meta>width|height|camera)"
+    r"|\$(?P<file_time>[emc])(?P<file_part>YYYY|MM|DD|hh|mm|ss)"
+    r"|\$(?P<date>YYYY|yyyy|MM|mm|DD|dd)"
+    r"|(?P<hashes>#+)=(?P<start>\d+)|#+(?![=0-9])|\$\$[pP]|\$p"
+)
+_DATE_PARTS = {"YYYY": "year", "yyyy": "year", "MM": "month", "mm": "month", "DD": "day", "dd": "day"}
+_FILE_TIME_SOURCES = {"e": "exif", "m": "mtime", "c": "ctime"}
+_FILE_TIME_PARTS = {"YYYY": "year", "MM": "month", "DD": "day", "hh": "hour", "mm": "minute", "ss": "second"}
+# 占位符在替换过程中以补充私用区字符代替，替换和文本格式转换都不会改变它们
+_SENTINEL_BASE = 0x10FF00
+_SENTINEL_LIMIT = 0xFE
+_SENTINEL_RE = re.compile("[\U0010FF00-\U0010FFFD]")
+
+
+class FolderContext:
+    """同一文件夹内所有文件共用的占位符取值：文件夹名、上级文件夹名与本次预览的时间。
+
+    由 Renamer.folder_context 为每个文件夹创建一次；values 缓存替换模板中
+    与序号无关的占位符取值（见 ReplaceTemplate.folder_values）；
+    snapshot 为文件夹的 rename_fs.DirectorySnapshot，仅在模板需要文件时间时读取。
+    """
+
+    def __init__(self, folder_path, folder_name, parent_folder_name, now, snapshot=None):
+        self.folder_path = folder_path
+        self.folder_name = folder_name
+        self.parent_folder_name = parent_folder_name
+        self.now = now
+        self.snapshot = snapshot
+        self.values = None
+
+    def stat(self, name):
+        """返回文件夹中文件的 stat 结果（来自目录快照），取不到时返回 None"""
+        if self.snapshot is None:
+            return None
+        return self.snapshot.stat(name)
+
+
+def file_datetime(stat, source):
+    """由 stat 结果返回文件的修改时间（mtime）或创建时间（ctime）；stat 为 None 时返回 None。
+
+    创建时间优先使用 st_birthtime，平台不提供时退回 st_ctime（Windows 上即创建时间）。
+    """
+    if stat is None:
+        return None
+    if source == "mtime":
+        timestamp = stat.st_mtime
+    else:
+        timestamp = getattr(stat, "st_birthtime", None)
+        if timestamp is None:
+            timestamp = stat.st_ctime
+    try:
+        return datetime.datetime.fromtimestamp(timestamp)
+    except (OverflowError, OSError, ValueError):
+        return None
+
+
+# 取值因文件而异的占位符
+_PER_FILE_KINDS = ("counter", "file_time", "meta")
+# 元数据中的文本不能出现在文件名中的字符
+_INVALID_NAME_CHARS_RE = re.compile(r'[<>:"/\\|?*\x00-\x1f]')
+
+
+def exif_datetime(meta):
+    """由元数据中的拍摄时间（Exif 格式 'YYYY:MM:DD hh:mm:ss'）返回 datetime，缺失或无效时返回 None"""
+    if not meta or not meta.get("date"):
+        return None
+    try:
+        return datetime.datetime.strptime(meta["date"][:19], "%Y:%m:%d %H:%M:%S")
+    except ValueError:
+        return None
+
+
+def meta_value(meta, name):
+    """返回元数据占位符（width/height/camera）的值，缺失时为空字符串"""
+    if not meta:
+        return ""
+    if name == "camera":
+        make = meta.get("make", "")
+        model = meta.get("model", "")
+        # 型号中通常已含厂商名（如 Canon EOS R5），否则拼上厂商名
+        if make and not model.lower().startswith(make.split()[0].lower()):
+            model = f"{make} {model}".strip()
+        return _INVALID_NAME_CHARS_RE.sub("_", model).strip()
+    value = meta.get(name)
+    return str(value) if value else ""
+
+
+class ReplaceTemplate:
+    """编译后的替换模板。
+
+    tokens 为 (kind, arg) 列表，kind 取值：
+    literal（原样文本）、counter（(位宽, 起始值)）、folder、parent_folder、date（year/month/day）、
+    file_time（(exif/mtime/ctime, year/month/day/hour/minute/second)）、meta（width/height/camera）。
+    只有包含 file_time 或 meta 占位符时（needs_stat）才会读取文件的 stat 信息，
+    只有包含拍摄时间或 meta 占位符时（needs_meta）才会读取图片元数据。
+    """
+
+    def __init__(self, source):
+        self.source = source or ""
+        self.tokens = []
+        pos = 0
+        for match in _TOKEN_RE.finditer(self.source):
+            if match.start() > pos:
+                self.tokens.append(("literal", self.source[pos:match.start()]))
+            text = match.group()
+            if match.group("meta"):
+                self.tokens.append(("meta", match.group("meta")))
+            elif match.group("file_time"):
+                source = _FILE_TIME_SOURCES[match.group("file_time")]
+                self.tokens.append(("file_time", (source, _FILE_TIME_PARTS[match.group("file_part")])))
+            elif match.group("date"):
+                self.tokens.append(("date", _DATE_PARTS[match.group("date")]))
+            elif match.group("hashes"):
+                self.tokens.append(("counter", (len(match.group("hashes")), int(match.group("start")))))
+            elif text.startswith("#"):
+                self.tokens.append(("counter", (len(text), 0)))
+            elif text.startswith("$$"):
+                self.tokens.append(("parent_folder", None))
+            else:
+                self.tokens.append(("folder", None))
+            pos = match.end()
+        if pos < len(self.source):
+            self.tokens.append(("literal", self.source[pos:]))
+
+        # 用于查找替换的模板：每个占位符替换为一个私用区字符
+        self.placeholders = []
+        # 序号、文件时间与元数据占位符 (code, kind, arg)：每个文件不同，其余占位符按文件夹计算一次
+        self.per_file = []
+        parts = []
+        for kind, arg in self.tokens:
+            if kind == "literal":
+                parts.append(arg)
+            else:
+                sentinel = chr(_SENTINEL_BASE + len(self.placeholders))
+                self.placeholders.append((ord(sentinel), kind, arg))
+                if kind in _PER_FILE_KINDS:
+                    self.per_file.append((ord(sentinel), kind, arg))
+                parts.append(sentinel)
+        # 私用区字符数量有限，占位符过多时改为逐个文件生成替换文本
+        self.marked = "".join(parts) if len(self.placeholders) <= _SENTINEL_LIMIT else None
+        self.needs_meta = any(
+            kind == "meta" or (kind == "file_time" and arg[0] == "exif") for kind, arg in self.tokens
+        )
+        self.needs_stat = self.needs_meta or any(kind == "file_time" for kind, arg in self.tokens)
+
+    def token_value(self, kind, arg, context, index, stat=None, meta=None):
+        """计算单个占位符的值；context 为 FolderContext，stat 为文件的 stat 结果，
+        meta 为文件的元数据（见 rename_meta）。
+        """
+        if kind == "counter":
+            width, start = arg
+            return f"{index + start:0{width}d}"
+        if kind == "meta":
+            return meta_value(meta, arg)
+        if kind == "file_time":
+            source, part = arg
+            if source == "exif":
+                # 没有拍摄时间（非图片或缺少 Exif）时使用修改时间
+                file_time = exif_datetime(meta) or file_datetime(stat, "mtime")
+            else:
+                file_time = file_datetime(stat, source)
+            if file_time is None:
+                return ""
+            if part == "year":
+                return str(file_time.year)
+            return f"{getattr(file_time, part):02d}"
+        if kind == "folder":
+            return context.folder_name
+        if kind == "parent_folder":
+            return f"{context.parent_folder_name}_{context.folder_name}"
+        if kind == "date":
+            if arg == "year":
+                return str(context.now.year)
+            return f"{getattr(context.now, arg):02d}"
+        return arg
+
+    def folder_values(self, context):
+        """返回与序号无关的占位符取值 {code: value}，同一文件夹只需计算一次"""
+        return {
+            code: self.token_value(kind, arg, context, 0)
+            for code, kind, arg in self.placeholders
+            if kind not in _PER_FILE_KINDS
+        }
+
+    def expand(self, text, context, index, stat=None, meta=None):
+        """将 text 中的占位符字符一次性替换为实际值"""
+        if not self.placeholders:
+            return text
+        if context.values is None:
+            context.values = self.folder_values(context)
+        table = context.values
+        if self.per_file:
+            table = dict(table)
+            for code, kind, arg in self.per_file:
+                table[code] = self.token_value(kind, arg, context, index, stat, meta)
+        return text.translate(table)
+
+    def render(self, context, index, stat=None, meta=None, escape=False):
+        """直接生成完整替换文本；escape 为 True 时对占位符的值做正则替换串转义"""
+        parts = []
+        for kind, arg in self.tokens:
+            if kind == "literal":
+                parts.append(arg)
+            else:
+                value = self.token_value(kind, arg, context, index, stat, meta)
+                parts.append(value.replace("\\", "\\\\") if escape else value)
+        return "".join(parts)
+
+
+@functools.lru_cache(maxsize=64)
+def _compile_pattern(search_text, flags):
+    return re.compile(search_text, flags)
+
+
+def compile_search(options):
+    """编译正则查找模式（结果按模式与大小写选项缓存）；非正则模式返回 None。
+
+    模式无效时抛出 RenameError。
+    """
+    if not options.use_regex or not options.search_text:
+        return None
+    flags = 0 if options.case_sensitive else re.IGNORECASE
+    try:
+        return _compile_pattern(options.search_text, flags)
+    except re.error as e:
+        raise RenameError(f"正则表达式错误: {e}") from e
+
+
+def perform_replace(text, options, replace_text=None, pattern=None):
+    """执行查找替换，并对结果应用文本格式。
+
+    replace_text 为 None 时使用 options.replace_text；pattern 为预先编译的正则，
+    正则模式下未提供时调用 compile_search。规则无效时抛出 RenameError。
+    """
+    search_text = options.search_text
+    if replace_text is None:
+        replace_text = options.replace_text
+    if not search_text:
+        return text
+
+    if options.use_regex:
+        # 使用正则表达式
+        if pattern is None:
+            pattern = compile_search(options)
+        try:
+            new_text = pattern.sub(replace_text, text, count=0 if options.match_all else 1)
+        except (re.error, IndexError) as e:
+            raise RenameError(f"替换文本错误: {e}") from e
+    else:
+        # 普通文本替换
+        if options.case_sensitive:
+            if options.match_all:
+                new_text = text.replace(search_text, replace_text)
+            else:
+                new_text = text.replace(search_text, replace_text, 1)
+        else:
+            # 不区分大小写 - 使用简单的不区分大小写替换
+            new_text = case_insensitive_replace(text, search_text, replace_text, options.match_all)
+
+    # 应用文本格式到替换后的文本
+    return format_text(new_text, options.text_format)
+
+
+def generate_template_name(original_name, name_template, parent_folder_name, folder_name, index):
+    """按主窗口命名模板生成新名称：# 序号、$p/$$p 文件夹名、* 保留原名"""
+    if not name_template:
+        return original_name
+
+    hash_count = name_template.count("#")
+    if hash_count > 0:
+        number_format = f"{{:0{hash_count}d}}"
+        new_name = name_template.replace("#" * hash_count, number_format.format(index))
+    else:
+        new_name = name_template
+
+    new_name = new_name.replace("$$p", f"{parent_folder_name}_{folder_name}")
+    new_name = new_name.replace("$p", folder_name)
+
+    file_extension = os.path.splitext(original_name)[1]
+
+    if "*" in name_template:
+        new_name += original_name
+    else:
+        new_name += file_extension
+
+    return new_name.replace("*", "")
+
+
+class Renamer:
+    """按选项预先编译好的单文件重命名器，一次预览只构造一次。
+
+    正则无效时构造即抛出 RenameError，不会对任何文件做处理。
+    snapshots 为 rename_fs.SnapshotCache，用于查询文件夹名称的实际大小写；
+    now 为日期占位符使用的时间，默认取构造时的当前时间，同一次预览中的文件日期一致；
+    metadata 为 rename_meta.MetadataCache，模板用到元数据占位符时才会使用。
+    """
+
+    def __init__(self, options=None, snapshots=None, now=None, metadata=None):
+        self.options = options if options is not None else RenameOptions()
+        self.snapshots = snapshots if snapshots is not None else rename_fs.SnapshotCache()
+        self.now = now if now is not None else datetime.datetime.now()
+        self.metadata = metadata
+        # 路径 -> 元数据，由 load_metadata 批量读取
+        self._meta = {}
+        # 文件夹路径 -> FolderContext，每个文件夹只计算一次
+        self._contexts = {}
+        self.template = ReplaceTemplate(self.options.replace_text)
+        self.pattern = None
+        if self.options.name_template is None:
+            self.pattern = compile_search(self.options)
+
+    def replace_name_part(self, name_part, context, index, stat=None, meta=None):
+        """对不含扩展名的文件名执行查找替换并展开占位符；context 为 FolderContext"""
+        options = self.options
+        template = self.template
+        if not template.placeholders:
+            return perform_replace(name_part, options, template.source, self.pattern)
+        if template.marked is None or _SENTINEL_RE.search(name_part):
+            # 文件名中恰好含有占位用的私用区字符时，逐个文件生成替换文本
+            replacement = template.render(context, index, stat, meta, escape=options.use_regex)
+            return perform_replace(name_part, options, replacement, self.pattern)
+        new_text = perform_replace(name_part, options, template.marked, self.pattern)
+        return template.expand(new_text, context, index, stat, meta)
+
+    def folder_context(self, folder_path):
+        """返回文件夹的 FolderContext；resolve_folder_case 时文件夹名使用磁盘上的实际大小写"""
+        context = self._contexts.get(folder_path)
+        if context is None:
+            parent_path = os.path.dirname(folder_path)
+            if self.options.resolve_folder_case:
+                folder_name = actual_cased_basename(folder_path, self.snapshots)
+                parent_folder_name = actual_cased_basename(parent_path, self.snapshots)
+            else:
+                folder_name = os.path.basename(folder_path)
+                parent_folder_name = os.path.basename(parent_path)
+            # 模板用到文件时间时，整个文件夹的 stat 信息来自同一次 scandir；
+            # 文件内容被修改时目录 mtime 不变，因此每次预览都重新扫描，不沿用缓存的 stat
+            snapshot = self.snapshots.get(folder_path, refresh=True) if self.template.needs_stat else None
+            context = FolderContext(folder_path, folder_name, parent_folder_name, self.now, snapshot)
+            self._contexts[folder_path] = context
+        return context
+
+    def rename(self, original_name, folder_path, index, context=None):
+        """计算单个文件的新名称；index 为文件在所属文件夹内的序号。
+
+        context 为该文件夹的 FolderContext，批量处理时按文件夹取一次后传入。
+        """
+        if context is None:
+            context = self.folder_context(folder_path)
+        options = self.options
+        if options.name_template is not None:
+            return generate_template_name(
+                original_name, options.name_template, context.parent_folder_name, context.folder_name, index
+            )
+
+        # 如果没有查找文本，或未勾选“包含文件”，保持原名
+        if not options.search_text or not options.include_files:
+            return original_name
+
+        name_part, ext_part = os.path.splitext(original_name)
+        stat = meta = None
+        if self.template.needs_stat:
+            stat = context.stat(original_name)
+            if self.template.needs_meta:
+                meta = self.file_metadata(os.path.join(folder_path, original_name), stat)
+        return self.replace_name_part(name_part, context, index, stat, meta) + ext_part
+
+    def _metadata_cache(self):
+        if self.metadata is None:
+            self.metadata = rename_meta.MetadataCache()
+        return self.metadata
+
+    def load_metadata(self, groups, cancel_check=None, progress=None):
+        """模板用到元数据占位符时，批量读取 group_by_folder 结果中所有文件的元数据。
+
+        返回 False 表示被取消；progress(完成数, 总数) 见 rename_meta.MetadataCache.load。
+        """
+        if not self.template.needs_meta or self.options.name_template is not None:
+            return True
+        items = []
+        for folder_path, group in groups:
+            context = self.folder_context(folder_path)
+            for file_path in group:
+                stat = context.stat(os.path.basename(file_path))
+                if stat is not None:
+                    items.append((file_path, stat))
+        meta = self._metadata_cache().load(items, cancel_check, progress)
+        if meta is None:
+            return False
+        self._meta = meta
+        return True
+
+    def file_metadata(self, file_path, stat):
+        """返回单个文件的元数据，未经 load_metadata 批量读取时单独读取"""
+        meta = self._meta.get(file_path)
+        if meta is None and stat is not None:
+            meta = self._metadata_cache().load([(file_path, stat)]).get(file_path)
+        return meta
+
+
+def plan(files, options=None, cancel_check=None, snapshots=None, metadata=None, progress=None):
+    """计算重命名计划。
+
+    files 为文件路径序列或 FileList；文件按文件夹分组、组内自然排序后从 0 开始编号。
+    返回 RenamePlan，其中包含所有文件（包括名称不变的文件），
+    并按“所有改名都会执行”检查冲突（见 rename_apply.find_conflicts）。
+    查找/替换规则无效时抛出 RenameError；cancel_check 为可选的无参函数，
+    在后台计算时定期调用，返回 True 则中止计算并返回 None；
+    snapshots 为可跨多次预览复用的 rename_fs.SnapshotCache；
+    模板用到元数据占位符时，先用 metadata（rename_meta.MetadataCache）批量读取元数据，
+    progress(完成数, 总数) 报告读取进度。
+    """
+    if snapshots is None:
+        snapshots = rename_fs.SnapshotCache()
+    renamer = Renamer(options, snapshots, metadata=metadata)
+    groups = group_by_folder(files, cancel_check, snapshots)
+    if groups is None:
+        return None
+    if not renamer.load_metadata(groups, cancel_check, progress):
+        return None
+    entries = []
+    changed_mask = bytearray()
+    for folder_path, group in groups:
+        context = renamer.folder_context(folder_path)
+        for index, file_path in enumerate(group):
+            if cancel_check is not None and len(entries) % _CANCEL_CHECK_INTERVAL == 0 and cancel_check():
+                return None
+            original_name = os.path.basename(file_path)
+            new_name = renamer.rename(original_name, folder_path, index, context)
+            entries.append((folder_path, original_name, new_name))
+            changed_mask.append(new_name != original_name)
+    conflicts = rename_apply.find_conflicts(entries, snapshots) if 1 in changed_mask else {}
+    return RenamePlan(entries, changed_mask, conflicts)
@@ -0,0 +1,280 @@
+"""文件系统辅助（不依赖 Qt）：目录快照缓存等。
+
+网络共享上每次 stat 都是一次往返，这里尽量用一次 os.scandir 取得整个目录的
+条目类型与 stat 信息，并按目录缓存。
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class DirectorySnapshot:
+    """单个目录的一次 os.scandir 快照。
+
+    entries 为 {名称: DirEntry}；DirEntry 自带类型位，Windows 上 stat() 也无需额外系统调用。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.mtime_ns = os.stat(path).st_mtime_ns
+        self.entries = {}
+        self._folded = None
+        with os.scandir(path) as it:
+            for entry in it:
+                self.entries[entry.name] = entry
+
+    def lookup(self, name):
+        """返回目录中与 name 对应的实际条目名称，不存在时返回 None。
+
+        Windows 上名称不区分大小写，精确匹配失败时按小写再查找一次。
+        """
+        if name in self.entries:
+            return name
+        if os.name != 'nt':
+            return None
+        if self._folded is None:
+            self._folded = {n.lower(): n for n in self.entries}
+        return self._folded.get(name.lower())
+
+    def actual_name(self, name):
+        """返回与 name 忽略大小写相同的实际条目名称（任何平台），不存在时返回 None"""
+        if name in self.entries:
+            return name
+        if self._folded is None:
+            self._folded = {n.lower(): n for n in self.entries}
+        return self._folded.get(name.lower())
+
+    def is_file(self, name):
+        actual = self.lookup(name)
+        if actual is None:
+            return False
+        try:
+            return self.entries[actual].is_file()
+        except OSError:
+            return False
+
+    def stat(self, name):
+        """返回条目的 stat 结果（DirEntry 会缓存），不存在时返回 None"""
+        actual = self.lookup(name)
+        if actual is None:
+            return None
+        try:
+            return self.entries[actual].stat()
+        except OSError:
+            return None
+
+
+class SnapshotCache:
+    """按目录缓存 DirectorySnapshot，可在多个线程中共享。
+
+    每次 get() 用一次 os.stat 检查目录 mtime，变化时重新扫描；
+    本程序自己的重命名通过 invalidate() 使对应目录失效。
+    修改文件内容不会改变目录 mtime，需要最新的文件 stat 信息时用 get(folder, refresh=True)。
+    """
+
+    def __init__(self):
+        self._snapshots = {}
+        self._lock = threading.Lock()
+
+    def get(self, folder, validate=True, refresh=False):
+        """返回目录快照；目录不存在或无法读取时返回 None。refresh 为 True 时总是重新扫描"""
+        with self._lock:
+            snapshot = None if refresh else self._snapshots.get(folder)
+        if snapshot is not None and validate:
+            try:
+                if os.stat(folder).st_mtime_ns != snapshot.mtime_ns:
+                    snapshot = None
+            except OSError:
+                snapshot = None
+        if snapshot is None:
+            try:
+                snapshot = DirectorySnapshot(folder)
+            except OSError:
+                self.invalidate(folder)
+                return None
+            with self._lock:
+                self._snapshots[folder] = snapshot
+        return snapshot
+
+    def cached(self, folder):
+        """目录是否已有快照（不做校验）"""
+        with self._lock:
+            return folder in self._snapshots
+
+    def invalidate(self, folder=None):
+        """使某个目录（folder 为 None 时为全部目录）的快照失效"""
+        with self._lock:
+            if folder is None:
+                self._snapshots.clear()
+            else:
+                self._snapshots.pop(folder, None)
+
+
+def normalize_path(path):
+    """规范化路径（分隔符、大小写），用于路径集合的比较"""
+    try:
+        return os.path.normcase(os.path.normpath(path))
+    except Exception:
+        return path
+
+
+def _path_parts(path):
+    return path.rstrip(os.sep).split(os.sep)
+
+
+class _TrieNode:
+    __slots__ = ("children", "terminal", "count")
+
+    def __init__(self):
+        self.children = {}
+        self.terminal = False
+        # 子树中（含自身）的路径数
+        self.count = 0
+
+
+class PathTrie:
+    """按路径分量组织的前缀树，路径须已用 normalize_path 规范化。
+
+    查询“自身或祖先在集合中”“有后代在集合中”均为 O(路径深度)，
+    代替对整个集合逐个 startswith 比较。
+    """
+
+    def __init__(self, paths=()):
+        self._root = _TrieNode()
+        for path in paths:
+            self.add(path)
+
+    def __len__(self):
+        return self._root.count
+
+    def __bool__(self):
+        return self._root.count > 0
+
+    def __contains__(self, path):
+        node = self._find(path)
+        return node is not None and node.terminal
+
+    def _find(self, path):
+        node = self._root
+        for part in _path_parts(path):
+            node = node.children.get(part)
+            if node is None:
+                return None
+        return node
+
+    def add(self, path):
+        """加入路径，返回是否为新路径"""
+        if path in self:
+            return False
+        node = self._root
+        node.count += 1
+        for part in _path_parts(path):
+            child = node.children.get(part)
+            if child is None:
+                child = node.children[part] = _TrieNode()
+            child.count += 1
+            node = child
+        node.terminal = True
+        return True
+
+    def discard(self, path):
+        """移除路径，返回是否存在"""
+        if path not in self:
+            return False
+        node = self._root
+        node.count -= 1
+        for part in _path_parts(path):
+            child = node.children[part]
+            child.count -= 1
+            if child.count == 0:
+                del node.children[part]
+                return True
+            node = child
+        node.terminal = False
+        return True
+
+    def clear(self):
+        self._root = _TrieNode()
+
+    def covers(self, path):
+        """path 本身或其某个祖先在集合中"""
+        node = self._root
+        for part in _path_parts(path):
+            node = node.children.get(part)
+            if node is None:
+                return False
+            if node.terminal:
+                return True
+        return False
+
+    def has_descendant(self, path):
+        """集合中有 path 的（严格）后代"""
+        node = self._find(path)
+        return node is not None and node.count > node.terminal
+
+
+# 遍历目录树时同时扫描的目录数
+WALK_WORKERS = 8
+
+
+def _scan_dir(path, excluded):
+    """扫描一个目录，返回按名称排序的 (文件列表, 子目录列表)。
+
+    类型判断使用 DirEntry 自带的信息，不对每个文件额外 stat；
+    与 os.walk 一致，不进入指向目录的符号链接。
+    """
+    files = []
+    dirs = []
+    try:
+        with os.scandir(path) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+    except OSError:
+        return files, dirs
+    for entry in entries:
+        try:
+            if entry.is_dir():
+                if not entry.is_symlink():
+                    dirs.append(entry.path)
+            elif entry.is_file():
+                files.append(entry.path)
+        except OSError:
+            continue
+    # 只有该目录下存在排除项时才逐个判断
+    if excluded and excluded.has_descendant(normalize_path(path)):
+        files = [f for f in files if not excluded.covers(normalize_path(f))]
+        dirs = [d for d in dirs if not excluded.covers(normalize_path(d))]
+    return files, dirs
+
+
+def iter_file_batches(roots, excluded=None, max_workers=WALK_WORKERS):
+    """遍历 roots（文件或目录）下的所有文件，按目录逐批返回文件路径列表。
+
+    顺序确定：按 roots 顺序、目录树先序、目录内按名称排序；
+    发现的子目录会提交到线程池提前扫描，消费方按顺序取结果。
+    excluded 为规范化路径的 PathTrie，被排除的目录不会进入。
+    """
+    pool = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        for root in roots:
+            if excluded and excluded.covers(normalize_path(root)):
+                continue
+            if os.path.isfile(root):
+                yield [root]
+            elif os.path.isdir(root):
+                stack = [pool.submit(_scan_dir, root, excluded)]
+                while stack:
+                    files, dirs = stack.pop().result()
+                    futures = [pool.submit(_scan_dir, d, excluded) for d in dirs]
+                    stack.extend(reversed(futures))
+                    if files:
+                        yield files
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def walk_files(roots, excluded=None, max_workers=WALK_WORKERS):
+    """返回 roots 下所有文件的列表（顺序见 iter_file_batches）"""
+    files = []
+    for batch in iter_file_batches(roots, excluded, max_workers):
+        files.extend(batch)
+    return files
@@ -0,0 +1,405 @@
+"""重命名日志（不依赖 Qt）：执行前写入计划，执行中追加完成标记。
+
+程序崩溃或被结束时，可根据日志继续执行剩余步骤或回滚已完成的步骤；
+正常完成的日志保留下来，用于撤销。
+
+日志为追加写入的 JSON 行：
+    {"journal": 1, "created": ..., "undo": ...}   文件头；undo 为被撤销、回滚的日志文件名（撤销本身的日志才有）
+    ["d", folder]                         定义文件夹，序号按出现顺序
+    ["c"]                                 开始一条新的链
+    ["s", folder_id, src, dst, index, final]   步骤，序号按出现顺序
+    ["p"]                                 计划写入完毕（此后才开始改名）
+    ["+", step_id] / ["!", step_id, error]      步骤完成 / 失败
+    ["e"]                                 执行结束
+    ["u"]                                 已被撤销或回滚
+完成标记按批 fsync，崩溃时最后一批标记可能丢失，恢复时按文件系统的实际状态补齐；
+环中移入、移出临时名称的两步会立即 fsync，否则“全部完成”与“尚未开始”无法区分。
+"""
+import array
+import json
+import os
+import threading
+import time
+
+import rename_apply
+
+
+JOURNAL_VERSION = 1
+JOURNAL_SUFFIX = ".journal"
+# 每写入多少个完成标记 fsync 一次
+FSYNC_EVERY = 512
+# 保留最近多少份日志
+JOURNAL_KEEP = 20
+
+STEP_DONE = "done"
+STEP_FAILED = "failed"
+STEP_PENDING = "pending"
+
+
+def default_journal_dir():
+    """日志目录：Windows 上位于 %LOCALAPPDATA%，其他平台位于 ~/.local/share"""
+    base = os.environ.get("LOCALAPPDATA")
+    if not base:
+        base = os.path.join(os.path.expanduser("~"), ".local", "share")
+    return os.path.join(base, "Rename", "journal")
+
+
+def _name_stamp(time_ns):
+    """日志文件名前缀：UTC 时间精确到纳秒，按字符串排序即按创建时间排序。
+
+    夏令时切换时本地时间会回拨，因此不用本地时间；追加结束/撤销标记会改变 mtime，也不能用 mtime。
+    """
+    seconds, ns = divmod(time_ns, 1_000_000_000)
+    return f"{time.strftime('%Y%m%d-%H%M%S', time.gmtime(seconds))}.{ns:09d}"
+
+
+def _fsync(handle):
+    handle.flush()
+    os.fsync(handle.fileno())
+
+
+class RenameJournal:
+    """一次执行的日志写入器。on_step 可直接作为 rename_apply.run_schedule 的回调"""
+
+    def __init__(self, path, handle, step_ids, sync_steps):
+        self.path = path
+        self._handle = handle
+        # 步骤序号按 entry_index * 2 + final 查找
+        self._step_ids = step_ids
+        self._sync_steps = sync_steps
+        self._lock = threading.Lock()
+        self._unsynced = 0
+
+    @classmethod
+    def create(cls, schedule, journal_dir=None, undo_of=None):
+        """写入计划并 fsync，返回 RenameJournal；此后才可开始执行。
+
+        undo_of 为被撤销或回滚的日志路径，撤销本身的日志不会再被 latest_undoable 当作可撤销的重命名。
+        """
+        journal_dir = journal_dir or default_journal_dir()
+        os.makedirs(journal_dir, exist_ok=True)
+        prune(journal_dir)
+        now_ns = time.time_ns()
+        prefix = f"{_name_stamp(now_ns)}-{os.getpid()}"
+        # 文件头中的时间用本地时间，便于阅读
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(now_ns // 1_000_000_000))
+        n = 0
+        while True:
+            path = os.path.join(journal_dir, f"{prefix}-{n}{JOURNAL_SUFFIX}")
+            try:
+                handle = open(path, "x", encoding="utf-8")
+                break
+            except FileExistsError:
+                n += 1
+        try:
+            dumps = json.dumps
+            header = {"journal": JOURNAL_VERSION, "created": stamp}
+            if undo_of is not None:
+                header["undo"] = os.path.basename(undo_of)
+            handle.write(dumps(header, ensure_ascii=False) + "\n")
+            step_ids = array.array("q", [-1]) * (2 * len(schedule.entries))
+            sync_steps = set()
+            step_count = 0
+            for folder_id, (folder, chains) in enumerate(schedule.steps.items()):
+                handle.write(dumps(["d", folder], ensure_ascii=False) + "\n")
+                for chain in chains:
+                    handle.write('["c"]\n')
+                    if not chain[0][3]:
+                        # 环：首步移到临时名称，末步从临时名称移出
+                        sync_steps.update((step_count, step_count + len(chain) - 1))
+                    for src, dst, index, final in chain:
+                        step_ids[index * 2 + final] = step_count
+                        step_count += 1
+                        line = ["s", folder_id, os.path.basename(src), os.path.basename(dst), index, final]
+                        handle.write(dumps(line, ensure_ascii=False) + "\n")
+            handle.write('["p"]\n')
+            _fsync(handle)
+        except Exception:
+            handle.close()
+            raise
+        return cls(path, handle, step_ids, sync_steps)
+
+    def on_step(self, src, dst, index, final, error):
+        """记录一个步骤的结果（可在多个线程中调用）"""
+        step_id = self._step_ids[index * 2 + final]
+        if error is None:
+            line = f'["+", {step_id}]\n'
+        else:
+            line = json.dumps(["!", step_id, error], ensure_ascii=False) + "\n"
+        with self._lock:
+            self._handle.write(line)
+            self._unsynced += 1
+            if self._unsynced >= FSYNC_EVERY or step_id in self._sync_steps:
+                _fsync(self._handle)
+                self._unsynced = 0
+
+    def close(self, finished=True):
+        """写入结束标记并关闭；finished 为 False 时（执行异常中止）不写结束标记，日志保持未完成状态"""
+        with self._lock:
+            if self._handle.closed:
+                return
+            if finished:
+                self._handle.write('["e"]\n')
+            _fsync(self._handle)
+            self._handle.close()
+
+
+class JournalState:
+    """从日志文件读取的计划与执行状态。
+
+    chains 为 [[(step_id, src_path, dst_path, entry_index, final), ...], ...]；
+    status 为 {step_id: STEP_DONE / STEP_FAILED}（只包含有标记的步骤）；
+    planned 表示计划已完整写入，finished 表示执行已结束，undone 表示已被撤销或回滚；
+    undo_of 为撤销、回滚日志所针对的日志文件名，普通重命名为 None。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.created = ""
+        self.undo_of = None
+        self.chains = []
+        self.status = {}
+        self.planned = False
+        self.finished = False
+        self.undone = False
+        folders = []
+        step_count = 0
+        with open(path, encoding="utf-8") as handle:
+            for line in handle:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 崩溃时最后一行可能只写了一半
+                    break
+                if isinstance(record, dict):
+                    self.created = record.get("created", "")
+                    self.undo_of = record.get("undo")
+                    continue
+                kind = record[0]
+                if kind == "+":
+                    self.status[record[1]] = STEP_DONE
+                elif kind == "!":
+                    self.status[record[1]] = STEP_FAILED
+                elif kind == "s":
+                    folder = folders[record[1]]
+                    self.chains[-1].append((
+                        step_count,
+                        os.path.join(folder, record[2]),
+                        os.path.join(folder, record[3]),
+                        record[4],
+                        record[5],
+                    ))
+                    step_count += 1
+                elif kind == "c":
+                    self.chains.append([])
+                elif kind == "d":
+                    folders.append(record[1])
+                elif kind == "p":
+                    self.planned = True
+                elif kind == "e":
+                    self.finished = True
+                elif kind == "u":
+                    self.undone = True
+        self.step_count = step_count
+
+    def interrupted(self):
+        """计划已写入但执行没有正常结束"""
+        return self.planned and not self.finished and not self.undone
+
+    def _step_states(self, chain):
+        """返回链中每个步骤的状态；没有标记的步骤按文件系统实际情况推断。
+
+        链中后一步的目标是前一步的源，因此从后往前找第一个源已不存在的步骤，
+        它及之前的步骤都已完成。环的首、末两步标记会立即写入磁盘，
+        结合临时文件是否存在即可判断环的状态。
+        """
+        status = self.status
+        states = [status.get(step[0]) for step in chain]
+        if not chain[0][4]:
+            temp = chain[0][2]
+            if states[0] is None:
+                states[0] = STEP_DONE if os.path.lexists(temp) else STEP_PENDING
+            if states[0] != STEP_DONE:
+                # 首步未完成：其余步骤要么已记为失败，要么未执行
+                return [state or STEP_PENDING for state in states]
+            if states[-1] is None:
+                states[-1] = STEP_PENDING if os.path.lexists(temp) else STEP_DONE
+            if states[-1] == STEP_DONE:
+                return [state or STEP_DONE for state in states]
+            self._infer_chain(chain, states, 1, len(chain) - 1)
+            return states
+        self._infer_chain(chain, states, 0, len(chain))
+        return states
+
+    @staticmethod
+    def _infer_chain(chain, states, start, stop):
+        done = False
+        for i in range(stop - 1, start - 1, -1):
+            if states[i] is not None:
+                # 有标记的步骤之前的步骤都已执行过（标记按顺序写入）
+                done = True
+                continue
+            if done or not os.path.lexists(chain[i][1]):
+                states[i] = STEP_DONE
+                done = True
+            else:
+                states[i] = STEP_PENDING
+
+    def pending_schedule(self):
+        """返回继续执行剩余步骤的 RenameSchedule"""
+        builder = _ScheduleBuilder()
+        for chain in self.chains:
+            steps = [step for step, state in zip(chain, self._step_states(chain)) if state == STEP_PENDING]
+            builder.add_chain(steps)
+        return builder.build()
+
+    def inverse_schedule(self):
+        """返回撤销已完成步骤的 RenameSchedule：每条链内倒序执行 dst -> src"""
+        builder = _ScheduleBuilder()
+        for chain in self.chains:
+            # 每个条目最初的源路径：逆向步骤到达这里时才算该条目撤销完成
+            origin = {}
+            for step_id, src, dst, index, final in chain:
+                origin.setdefault(index, src)
+            steps = [
+                (step_id, dst, src, index, src == origin[index])
+                for (step_id, src, dst, index, final), state in zip(chain, self._step_states(chain))
+                if state == STEP_DONE
+            ]
+            steps.reverse()
+            builder.add_chain(steps)
+        return builder.build()
+
+    def path_map(self):
+        """返回已完成改名的条目 {原路径: 新路径}"""
+        paths = {}
+        for chain in self.chains:
+            origin = {}
+            for (step_id, src, dst, index, final), state in zip(chain, self._step_states(chain)):
+                origin.setdefault(index, src)
+                if final and state == STEP_DONE:
+                    paths[origin[index]] = dst
+        return paths
+
+    def mark_finished(self):
+        """继续执行完剩余步骤后追加结束标记，之后可以撤销整个计划"""
+        with open(self.path, "a", encoding="utf-8") as handle:
+            handle.write('["e"]\n')
+            _fsync(handle)
+        self.finished = True
+
+    def mark_undone(self):
+        """在日志末尾追加撤销标记，之后不再提供撤销或恢复"""
+        with open(self.path, "a", encoding="utf-8") as handle:
+            handle.write('["u"]\n')
+            _fsync(handle)
+        self.undone = True
+
+
+class _ScheduleBuilder:
+    """把日志中的步骤重新组装成 RenameSchedule，条目序号重新编号"""
+
+    def __init__(self):
+        self.entries = []
+        self.steps = {}
+        self._index = {}
+
+    def add_chain(self, steps):
+        if not steps:
+            return
+        chain = []
+        for step_id, src, dst, index, final in steps:
+            new_index = self._index.get(index)
+            if new_index is None:
+                new_index = self._index[index] = len(self.entries)
+                self.entries.append([os.path.dirname(src), os.path.basename(src), os.path.basename(dst)])
+            elif final:
+                self.entries[new_index][2] = os.path.basename(dst)
+            chain.append((src, dst, new_index, final))
+        self.steps.setdefault(os.path.dirname(steps[0][1]), []).append(chain)
+
+    def build(self):
+        schedule = rename_apply.RenameSchedule(tuple(entry) for entry in self.entries)
+        schedule.steps = self.steps
+        return schedule
+
+
+def list_journals(journal_dir=None):
+    """返回日志文件路径，按创建时间从新到旧排列"""
+    journal_dir = journal_dir or default_journal_dir()
+    try:
+        names = [name for name in os.listdir(journal_dir) if name.endswith(JOURNAL_SUFFIX)]
+    except OSError:
+        return []
+    names.sort(reverse=True)
+    return [os.path.join(journal_dir, name) for name in names]
+
+
+def renamed_paths(journal_dir=None, since=None):
+    """按时间顺序合并日志中已完成的改名，返回 {最初路径: 当前路径}。
+
+    since 为时间戳（秒），只合并此后创建的日志（按文件名中的创建时间判断；
+    撤销时会在原日志末尾追加标记，mtime 会变）。
+    撤销、回滚本身也是一次记录在日志中的改名，因此合并后即为最终位置。
+    """
+    mapping = {}
+    # 当前路径 -> 最初路径
+    origins = {}
+    since_stamp = None if since is None else _name_stamp(int(since * 1_000_000_000))
+    for path in reversed(list_journals(journal_dir)):
+        if since_stamp is not None and os.path.basename(path) < since_stamp:
+            continue
+        try:
+            state = JournalState(path)
+        except (OSError, ValueError, IndexError) as e:
+            print(f"读取重命名日志失败: {path}: {e}")
+            continue
+        # 同一次执行中的改名是同时生效的（互换、成环）：先按执行前的状态找到所有最初路径，再统一更新
+        changes = state.path_map()
+        moved = [(origins.get(old_path, old_path), new_path) for old_path, new_path in changes.items()]
+        for old_path in changes:
+            origins.pop(old_path, None)
+        for origin, new_path in moved:
+            mapping[origin] = new_path
+            origins[new_path] = origin
+    return mapping
+
+
+def find_interrupted(journal_dir=None):
+    """返回执行中断（未正常结束）的日志 JournalState 列表"""
+    result = []
+    for path in list_journals(journal_dir):
+        try:
+            state = JournalState(path)
+        except (OSError, ValueError, IndexError) as e:
+            print(f"读取重命名日志失败: {path}: {e}")
+            continue
+        if state.interrupted():
+            result.append(state)
+    return result
+
+
+def latest_undoable(journal_dir=None):
+    """返回最近一次正常结束的日志 JournalState；它已被撤销或没有日志时返回 None。
+
+    撤销、回滚本身的日志不算（否则再次撤销会重新执行原来的重命名）。
+    """
+    for path in list_journals(journal_dir):
+        try:
+            state = JournalState(path)
+        except (OSError, ValueError, IndexError) as e:
+            print(f"读取重命名日志失败: {path}: {e}")
+            continue
+        if state.finished and state.undo_of is None:
+            return None if state.undone else state
+    return None
+
+
+def prune(journal_dir=None, keep=JOURNAL_KEEP):
+    """删除较旧的已结束日志，只保留最近 keep 份（中断的日志不删除）"""
+    for path in list_journals(journal_dir)[keep:]:
+        try:
+            if not JournalState(path).interrupted():
+                os.remove(path)
+        except (OSError, ValueError, IndexError):
+            pass
@@ -0,0 +1,294 @@
+"""图片元数据（不依赖 Qt）：拍摄时间、尺寸、相机型号，供替换模板中的元数据占位符使用。
+
+只解析文件头部：用 mmap 映射文件，JPEG 扫描到图像数据开始（SOS）为止，
+TIFF 系（含多数 RAW）只读 IFD0 与 Exif IFD，PNG 只读 IHDR，实际只会读入头部的几页。
+提取在线程池中进行，结果按 (路径, 大小, mtime) 缓存在内存和 SQLite 中，
+再次预览或重新打开窗口时不必重新读取文件。
+"""
+import json
+import mmap
+import os
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+
+# 同时读取的文件数
+META_WORKERS = 8
+# 每完成多少个文件报告一次进度
+PROGRESS_EVERY = 64
+# 查询 SQLite 时每条语句包含的路径数
+_QUERY_CHUNK = 500
+
+# TIFF 标签
+_TAG_IMAGE_WIDTH = 0x0100
+_TAG_IMAGE_LENGTH = 0x0101
+_TAG_MAKE = 0x010F
+_TAG_MODEL = 0x0110
+_TAG_DATETIME = 0x0132
+_TAG_EXIF_IFD = 0x8769
+_TAG_DATETIME_ORIGINAL = 0x9003
+_TAG_PIXEL_X = 0xA002
+_TAG_PIXEL_Y = 0xA003
+# JPEG 中带有图像尺寸的 SOF 标记（不含 DHT/JPG/DAC）
+_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def default_cache_path():
+    """缓存数据库：Windows 上位于 %LOCALAPPDATA%，其他平台位于 ~/.local/share"""
+    base = os.environ.get("LOCALAPPDATA")
+    if not base:
+        base = os.path.join(os.path.expanduser("~"), ".local", "share")
+    return os.path.join(base, "Rename", "metadata.sqlite3")
+
+
+def _read_ifd(buf, base, offset, endian, tags):
+    """读取一个 IFD 中的指定标签，返回 {tag: 值}；值为字符串（ASCII）或整数"""
+    values = {}
+    count = struct.unpack_from(endian + "H", buf, base + offset)[0]
+    entry = base + offset + 2
+    for _ in range(count):
+        tag, kind, n = struct.unpack_from(endian + "HHI", buf, entry)
+        if tag in tags:
+            if kind == 2:  # ASCII
+                start = entry + 8 if n <= 4 else base + struct.unpack_from(endian + "I", buf, entry + 8)[0]
+                raw = bytes(buf[start:start + n])
+                values[tag] = raw.split(b"\0", 1)[0].decode("latin-1").strip()
+            elif kind == 3:  # SHORT
+                values[tag] = struct.unpack_from(endian + "H", buf, entry + 8)[0]
+            elif kind == 4:  # LONG
+                values[tag] = struct.unpack_from(endian + "I", buf, entry + 8)[0]
+        entry += 12
+    return values
+
+
+def _parse_tiff(buf, base):
+    """解析 base 处的 TIFF 头（Exif 数据或 TIFF/RAW 文件本身）"""
+    order = bytes(buf[base:base + 2])
+    if order == b"II":
+        endian = "<"
+    elif order == b"MM":
+        endian = ">"
+    else:
+        return {}
+    magic, ifd0 = struct.unpack_from(endian + "HI", buf, base + 2)
+    if magic != 42:
+        return {}
+    ifd = _read_ifd(
+        buf, base, ifd0, endian,
+        {_TAG_IMAGE_WIDTH, _TAG_IMAGE_LENGTH, _TAG_MAKE, _TAG_MODEL, _TAG_DATETIME, _TAG_EXIF_IFD},
+    )
+    exif = {}
+    if _TAG_EXIF_IFD in ifd:
+        exif = _read_ifd(buf, base, ifd[_TAG_EXIF_IFD], endian, {_TAG_DATETIME_ORIGINAL, _TAG_PIXEL_X, _TAG_PIXEL_Y})
+    meta = {}
+    date = exif.get(_TAG_DATETIME_ORIGINAL) or ifd.get(_TAG_DATETIME)
+    if date:
+        meta["date"] = date
+    width = exif.get(_TAG_PIXEL_X) or ifd.get(_TAG_IMAGE_WIDTH)
+    height = exif.get(_TAG_PIXEL_Y) or ifd.get(_TAG_IMAGE_LENGTH)
+    if width and height:
+        meta["width"], meta["height"] = width, height
+    for key, tag in (("make", _TAG_MAKE), ("model", _TAG_MODEL)):
+        if ifd.get(tag):
+            meta[key] = ifd[tag]
+    return meta
+
+
+def _parse_jpeg(buf):
+    meta = {}
+    size = None
+    pos = 2
+    end = len(buf)
+    while pos + 4 <= end:
+        if buf[pos] != 0xFF:
+            break
+        marker = buf[pos + 1]
+        if marker == 0xFF:
+            pos += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            pos += 2
+            continue
+        if marker in (0xD9, 0xDA):
+            # 图像数据开始，头部到此为止
+            break
+        length = struct.unpack_from(">H", buf, pos + 2)[0]
+        segment = pos + 4
+        if marker == 0xE1 and not meta and bytes(buf[segment:segment + 6]) == b"Exif\0\0":
+            meta = _parse_tiff(buf, segment + 6)
+        elif marker in _SOF_MARKERS and size is None:
+            height, width = struct.unpack_from(">HH", buf, segment + 1)
+            size = (width, height)
+        pos += 2 + length
+    if size is not None and all(size):
+        # 以实际编码的尺寸为准
+        meta["width"], meta["height"] = size
+    return meta
+
+
+def _parse_png(buf):
+    if bytes(buf[12:16]) != b"IHDR":
+        return {}
+    width, height = struct.unpack_from(">II", buf, 16)
+    return {"width": width, "height": height}
+
+
+def parse_header(buf):
+    """解析图片文件头，返回元数据 dict（date/width/height/make/model，缺失的键不出现）"""
+    try:
+        if bytes(buf[:2]) == b"\xff\xd8":
+            return _parse_jpeg(buf)
+        if bytes(buf[:8]) == _PNG_SIGNATURE:
+            return _parse_png(buf)
+        if bytes(buf[:4]) in (b"II*\0", b"MM\0*"):
+            return _parse_tiff(buf, 0)
+    except (struct.error, IndexError, ValueError):
+        pass
+    return {}
+
+
+def read_metadata(path):
+    """读取单个文件的元数据；不是支持的图片格式或读取失败时返回空 dict"""
+    try:
+        with open(path, "rb") as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+                return parse_header(buf)
+    except (OSError, ValueError):
+        # 空文件无法 mmap（ValueError）
+        return {}
+
+
+class MetadataCache:
+    """按 (路径, 大小, mtime) 缓存文件元数据，可在多个线程中共享。
+
+    内存中保留本次运行读取过的结果；path 为 SQLite 数据库路径（默认 default_cache_path()），
+    为 None 时只使用内存缓存。sqlite3 不可用时同样只使用内存缓存。
+    """
+
+    def __init__(self, path="", max_workers=META_WORKERS):
+        self.path = default_cache_path() if path == "" else path
+        self.max_workers = max_workers
+        # 路径 -> (大小, mtime_ns, 元数据)
+        self._memory = {}
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        if self.path is None or sqlite3 is None:
+            return None
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS metadata "
+                "(path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, data TEXT)"
+            )
+            return conn
+        except (OSError, sqlite3.Error) as e:
+            print(f"打开元数据缓存失败: {e}")
+            return None
+
+    def _read_db(self, conn, keys):
+        """从数据库中取出仍然有效的记录，keys 为 {路径: (大小, mtime_ns)}"""
+        found = {}
+        paths = list(keys)
+        try:
+            for i in range(0, len(paths), _QUERY_CHUNK):
+                chunk = paths[i:i + _QUERY_CHUNK]
+                rows = conn.execute(
+                    f"SELECT path, size, mtime_ns, data FROM metadata WHERE path IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                )
+                for path, size, mtime_ns, data in rows:
+                    if keys[path] == (size, mtime_ns):
+                        found[path] = json.loads(data)
+        except (sqlite3.Error, ValueError) as e:
+            print(f"读取元数据缓存失败: {e}")
+        return found
+
+    def _write_db(self, conn, rows):
+        try:
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?)", rows)
+        except sqlite3.Error as e:
+            print(f"写入元数据缓存失败: {e}")
+
+    def rename_paths(self, paths):
+        """本程序重命名文件后按 {原路径: 新路径} 转移内存中的记录（改名不改变大小与 mtime）"""
+        with self._lock:
+            moved = [(new_path, self._memory.pop(old_path, None)) for old_path, new_path in paths.items()]
+            for new_path, cached in moved:
+                if new_path is not None and cached is not None:
+                    self._memory[new_path] = cached
+
+    def load(self, items, cancel_check=None, progress=None):
+        """返回 {路径: 元数据}；items 为 [(路径, stat), ...]，stat 用于判断缓存是否有效。
+
+        缓存中没有的文件在线程池中读取；progress(完成数, 总数) 在调用线程中定期调用；
+        cancel_check() 返回 True 时中止并返回 None（已读取的结果仍会写入缓存）。
+        """
+        result = {}
+        keys = {}
+        with self._lock:
+            for path, stat in items:
+                key = (stat.st_size, stat.st_mtime_ns)
+                cached = self._memory.get(path)
+                if cached is not None and cached[:2] == key:
+                    result[path] = cached[2]
+                else:
+                    keys[path] = key
+        if not keys:
+            return result
+
+        total = len(items)
+        conn = self._connect()
+        try:
+            if conn is not None:
+                found = self._read_db(conn, keys)
+                result.update(found)
+                with self._lock:
+                    for path, meta in found.items():
+                        self._memory[path] = keys.pop(path) + (meta,)
+            if progress is not None:
+                progress(len(result), total)
+
+            fresh = {}
+            cancelled = False
+            if keys:
+                pool = ThreadPoolExecutor(max_workers=self.max_workers)
+                try:
+                    futures = {pool.submit(read_metadata, path): path for path in keys}
+                    for done, future in enumerate(as_completed(futures), 1):
+                        fresh[futures[future]] = future.result()
+                        if done % PROGRESS_EVERY == 0:
+                            if cancel_check is not None and cancel_check():
+                                cancelled = True
+                                break
+                            if progress is not None:
+                                progress(len(result) + done, total)
+                finally:
+                    pool.shutdown(wait=False, cancel_futures=True)
+
+            with self._lock:
+                for path, meta in fresh.items():
+                    self._memory[path] = keys[path] + (meta,)
+            if conn is not None and fresh:
+                self._write_db(
+                    conn,
+                    [(path, *keys[path], json.dumps(meta, ensure_ascii=False)) for path, meta in fresh.items()],
+                )
+        finally:
+            if conn is not None:
+                conn.close()
+        if cancelled:
+            return None
+        result.update(fresh)
+        if progress is not None:
+            progress(total, total)
+        return result
@@ -0,0 +1,70 @@
+import os
+
+import pytest
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+QtWidgets = pytest.importorskip("PyQt5.QtWidgets")
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    # 日志与元数据缓存写到临时目录，提示框不弹出
+    monkeypatch.setenv("LOCALAPPDATA", str(tmp_path / "appdata"))
+    for name in ("information", "warning", "critical"):
+        monkeypatch.setattr(QtWidgets.QMessageBox, name, staticmethod(lambda *args, **kwargs: None))
+    return QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+
+
+def test_update_file_list_after_apply_and_outside_undo(app, tmp_path):
+    import rename
+
+    folder = tmp_path / "files"
+    folder.mkdir()
+    a, b = str(folder / "a.txt"), str(folder / "b.txt")
+    with open(a, "w", encoding="utf-8") as f:
+        f.write("a")
+    dialog = rename.PowerRenameDialog([a])
+    dialog.search_input.setText("a")
+    dialog.replace_input.setText("b")
+    dialog.apply_rename()
+    assert list(dialog.file_list) == [b]
+
+    # 主窗口撤销：撤销日志之外，原日志末尾也会追加撤销标记
+    rename.undo_last_rename(None, lambda schedule, results: None)
+    assert os.path.exists(a)
+    dialog.refresh_file_list()
+    assert list(dialog.file_list) == [a]
+    dialog.close()
+
+
+def test_conflicts_follow_checked_rows(app, tmp_path):
+    import rename
+    from PyQt5.QtCore import Qt
+
+    folder = tmp_path / "files"
+    folder.mkdir()
+    paths = []
+    for name in ("a.txt", "aa.txt"):
+        paths.append(str(folder / name))
+        with open(paths[-1], "w", encoding="utf-8") as f:
+            f.write(name)
+    dialog = rename.PowerRenameDialog(paths)
+    dialog.search_input.setText("a")
+    dialog.replace_input.setText("aa")
+    dialog.update_preview()
+    model = dialog.preview_model
+    # a.txt -> aa.txt -> aaaa.txt 是一条链，全部勾选时没有冲突
+    assert model.conflict_count() == 0
+
+    # 不改名的 aa.txt 仍占用 a.txt 的目标名称
+    row = [old_name for _, old_name, _ in model.rows].index("aa.txt")
+    model.setData(model.index(row, 0), Qt.Unchecked, Qt.CheckStateRole)
+    assert model.conflict_count() == 1
+    assert not dialog.apply_btn.isEnabled()
+    dialog.update_preview()
+    assert model.conflict_count() == 1
+
+    dialog.select_all_checkbox.setChecked(True)
+    assert model.conflict_count() == 0
+    assert dialog.apply_btn.isEnabled()
+    dialog.close()
@@ -0,0 +1,88 @@
+import os
+
+import rename_apply
+
+
+def _touch(folder, *names):
+    for name in names:
+        with open(os.path.join(folder, name), "w", encoding="utf-8") as f:
+            f.write(name)
+
+
+def _contents(folder):
+    result = {}
+    for name in os.listdir(folder):
+        with open(os.path.join(folder, name), encoding="utf-8") as f:
+            result[name] = f.read()
+    return result
+
+
+def test_swap_uses_temp_name(tmp_path):
+    folder = str(tmp_path)
+    _touch(folder, "a", "b")
+    schedule = rename_apply.schedule_renames([(folder, "a", "b"), (folder, "b", "a")])
+    chains = list(schedule.chains())
+    assert len(chains) == 1
+    # 首步移到临时名称，末步从临时名称移到目标
+    assert not chains[0][0][3] and chains[0][-1][3]
+    assert rename_apply.run_schedule(schedule) == {0: None, 1: None}
+    assert _contents(folder) == {"a": "b", "b": "a"}
+
+
+def test_shift_by_one_runs_as_chain(tmp_path):
+    folder = str(tmp_path)
+    _touch(folder, "1", "2", "3")
+    entries = [(folder, "1", "2"), (folder, "2", "3"), (folder, "3", "4")]
+    schedule = rename_apply.schedule_renames(entries)
+    chains = list(schedule.chains())
+    assert len(chains) == 1
+    assert [os.path.basename(src) for src, dst, index, final in chains[0]] == ["3", "2", "1"]
+    assert all(final for src, dst, index, final in chains[0])
+    assert rename_apply.run_schedule(schedule) == {0: None, 1: None, 2: None}
+    assert _contents(folder) == {"2": "1", "3": "2", "4": "3"}
+
+
+def test_duplicate_targets_all_fail(tmp_path):
+    folder = str(tmp_path)
+    _touch(folder, "a", "b")
+    schedule = rename_apply.schedule_renames([(folder, "a", "c"), (folder, "b", "c")])
+    assert schedule.failures == {
+        0: rename_apply.REASON_DUPLICATE_TARGET,
+        1: rename_apply.REASON_DUPLICATE_TARGET,
+    }
+    assert schedule.step_count() == 0
+
+
+def test_occupied_target_fails_down_the_chain(tmp_path):
+    folder = str(tmp_path)
+    _touch(folder, "a", "b", "c", "x")
+    # b 的目标 x 不参与改名，b 无法改名，依赖 b 让出名称的 a 也随之失败
+    entries = [(folder, "a", "b"), (folder, "b", "x"), (folder, "c", "d")]
+    schedule = rename_apply.schedule_renames(entries)
+    assert schedule.failures == {0: rename_apply.REASON_TARGET_EXISTS, 1: rename_apply.REASON_TARGET_EXISTS}
+    assert rename_apply.find_conflicts(entries) == schedule.failures
+    results = rename_apply.run_schedule(schedule)
+    assert results[2] is None
+    assert sorted(os.listdir(folder)) == ["a", "b", "d", "x"]
+
+
+def test_failed_step_blocks_rest_of_chain(tmp_path):
+    folder = str(tmp_path)
+    _touch(folder, "a", "b")
+    schedule = rename_apply.schedule_renames([(folder, "a", "b"), (folder, "b", "c")])
+    # 规划之后目标被占用：b -> c 失败，a -> b 不能覆盖仍在原处的 b
+    _touch(folder, "c")
+    results = rename_apply.run_schedule(schedule)
+    assert results[1] is not None
+    assert results[0] == rename_apply.REASON_TARGET_EXISTS
+    assert _contents(folder) == {"a": "a", "b": "b", "c": "c"}
+
+
+def test_case_only_rename(tmp_path):
+    folder = str(tmp_path)
+    _touch(folder, "a.txt")
+    schedule = rename_apply.schedule_renames([(folder, "a.txt", "A.txt")], case_insensitive=True)
+    assert schedule.failures == {}
+    assert [[step[3] for step in chain] for chain in schedule.chains()] == [[True]]
+    assert rename_apply.run_schedule(schedule) == {0: None}
+    assert os.listdir(folder) == ["A.txt"]
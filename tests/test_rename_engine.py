@@ -0,0 +1,109 @@
+import datetime
+import os
+import time
+
+import pytest
+
+import rename_engine
+import rename_fs
+
+
+def _touch(folder, *names):
+    paths = []
+    for name in names:
+        paths.append(os.path.join(folder, name))
+        with open(paths[-1], "w", encoding="utf-8") as f:
+            f.write(name)
+    return paths
+
+
+def _new_names(files, options, snapshots=None):
+    return [new_name for folder, old_name, new_name in rename_engine.plan(files, options, snapshots=snapshots)]
+
+
+def test_file_time_tokens_follow_content_changes(tmp_path):
+    folder = str(tmp_path)
+    files = _touch(folder, "a.txt")
+    options = rename_engine.RenameOptions("a", "$mYYYY")
+    snapshots = rename_fs.SnapshotCache()
+    stamp = time.mktime((2020, 6, 1, 12, 0, 0, 0, 0, -1))
+    os.utime(files[0], (stamp, stamp))
+    assert _new_names(files, options, snapshots) == ["2020.txt"]
+
+    # 修改文件不会改变目录 mtime，再次预览仍要取得新的文件时间
+    folder_mtime = os.stat(folder).st_mtime_ns
+    stamp = time.mktime((2021, 6, 1, 12, 0, 0, 0, 0, -1))
+    os.utime(files[0], (stamp, stamp))
+    assert os.stat(folder).st_mtime_ns == folder_mtime
+    assert _new_names(files, options, snapshots) == ["2021.txt"]
+
+
+def test_replace_tokens():
+    options = rename_engine.RenameOptions("a", "##_$p_$$p_$YYYY$MM$DD")
+    renamer = rename_engine.Renamer(options, now=datetime.datetime(2024, 3, 5))
+    folder = os.path.join(os.sep, "photos", "Par", "Alpha")
+    assert renamer.rename("a.txt", folder, 3) == "03_Alpha_Par_Alpha_20240305.txt"
+
+    options = rename_engine.RenameOptions("a", "###=10-")
+    assert rename_engine.Renamer(options).rename("a.txt", folder, 2) == "012-.txt"
+
+
+def test_readme_file_time_example(tmp_path):
+    files = _touch(str(tmp_path), "IMG.jpg")
+    stamp = time.mktime((2021, 7, 8, 9, 10, 11, 0, 0, -1))
+    os.utime(files[0], (stamp, stamp))
+    options = rename_engine.RenameOptions("IMG", "$mYYYY$mMM$mDD_$mhh$mmm$mss")
+    assert rename_engine.ReplaceTemplate(options.replace_text).needs_stat
+    assert _new_names(files, options) == ["20210708_091011.jpg"]
+
+
+def test_regex_replace_with_tokens():
+    options = rename_engine.RenameOptions(r"(\d+)", r"#_\1", use_regex=True)
+    assert rename_engine.Renamer(options).rename("img42.jpg", os.sep, 0) == "img0_42.jpg"
+
+
+def test_invalid_regex_raises_rename_error():
+    with pytest.raises(rename_engine.RenameError):
+        rename_engine.Renamer(rename_engine.RenameOptions("(", "x", use_regex=True))
+    with pytest.raises(rename_engine.RenameError):
+        rename_engine.plan(["a.txt"], rename_engine.RenameOptions("(", "x", use_regex=True))
+    # 替换文本引用不存在的分组
+    renamer = rename_engine.Renamer(rename_engine.RenameOptions("a", r"\2", use_regex=True))
+    with pytest.raises(rename_engine.RenameError):
+        renamer.rename("a.txt", os.sep, 0)
+
+
+def test_case_insensitive_replace():
+    replace = rename_engine.case_insensitive_replace
+    assert replace("ABCabc", "b", "-") == "A-Ca-c"
+    assert replace("ABCabc", "b", "-", replace_all=False) == "A-Cabc"
+    # "İ" 小写后为两个字符，位置仍要对应到原文本
+    assert replace("xİyY", "y", "z") == "xİzz"
+    assert replace("İstanbul", "STAN", "-") == "İ-bul"
+    # 匹配落在 "İ" 小写展开的中间时不替换
+    assert replace("İx", "i", "-") == "İx"
+
+
+def test_natural_sort_order():
+    names = ["file10.txt", "File2.txt", "file1.txt", "file01.txt", "b.txt", "_a.txt", "1.txt", "é.txt", "f.txt"]
+    assert sorted(names, key=rename_engine.natural_sort_key) == [
+        # 符号 < 数字 < 字母；字母不区分大小写，重音字母排在基本字母处；数字按数值比较
+        "_a.txt", "1.txt", "b.txt", "é.txt", "f.txt", "file01.txt", "file1.txt", "File2.txt", "file10.txt",
+    ]
+    # 只比较末级文件名
+    assert rename_engine.natural_sort_key(os.path.join("z", "a")) < rename_engine.natural_sort_key("b")
+
+
+def test_file_list_groups_sorted_per_folder():
+    first, second = os.path.join(os.sep, "x"), os.path.join(os.sep, "y")
+    files = rename_engine.FileList([
+        os.path.join(second, "b"),
+        os.path.join(first, "10"),
+        os.path.join(first, "9"),
+        os.path.join(second, "a"),
+        os.path.join(first, "9"),
+    ])
+    assert len(files) == 4
+    groups = [(folder, [os.path.basename(path) for path in group]) for folder, group in files.groups()]
+    # 文件夹按其中排在最前的文件排序
+    assert groups == [(first, ["9", "10"]), (second, ["a", "b"])]
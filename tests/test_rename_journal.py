@@ -0,0 +1,94 @@
+import os
+import time
+
+import rename_apply
+import rename_journal
+
+
+def _run(entries, journal_dir):
+    schedule = rename_apply.schedule_renames(entries)
+    journal = rename_journal.RenameJournal.create(schedule, journal_dir)
+    results = rename_apply.run_schedule(schedule, journal.on_step)
+    journal.close()
+    return results
+
+
+def _touch(folder, *names):
+    for name in names:
+        with open(os.path.join(folder, name), "w", encoding="utf-8") as f:
+            f.write(name)
+
+
+def test_renamed_paths_swap(tmp_path):
+    folder, journal_dir = str(tmp_path / "files"), str(tmp_path / "journal")
+    os.mkdir(folder)
+    _touch(folder, "a", "b")
+    _run([(folder, "a", "b"), (folder, "b", "a")], journal_dir)
+    a, b = os.path.join(folder, "a"), os.path.join(folder, "b")
+    assert rename_journal.renamed_paths(journal_dir) == {a: b, b: a}
+
+
+def test_renamed_paths_rotation_and_undo(tmp_path):
+    folder, journal_dir = str(tmp_path / "files"), str(tmp_path / "journal")
+    os.mkdir(folder)
+    _touch(folder, "1", "2", "3")
+    _run([(folder, "1", "2"), (folder, "2", "3"), (folder, "3", "1")], journal_dir)
+    p1, p2, p3 = (os.path.join(folder, n) for n in ("1", "2", "3"))
+    assert rename_journal.renamed_paths(journal_dir) == {p1: p2, p2: p3, p3: p1}
+
+    state = rename_journal.latest_undoable(journal_dir)
+    inverse = state.inverse_schedule()
+    journal = rename_journal.RenameJournal.create(inverse, journal_dir)
+    rename_apply.run_schedule(inverse, journal.on_step)
+    journal.close()
+    state.mark_undone()
+    assert rename_journal.renamed_paths(journal_dir) == {p1: p1, p2: p2, p3: p3}
+    for name in ("1", "2", "3"):
+        with open(os.path.join(folder, name), encoding="utf-8") as f:
+            assert f.read() == name
+
+
+def test_renamed_paths_since_ignores_marks_on_older_journals(tmp_path):
+    folder, journal_dir = str(tmp_path / "files"), str(tmp_path / "journal")
+    os.mkdir(folder)
+    _touch(folder, "a")
+    _run([(folder, "a", "b")], journal_dir)
+    # 窗口已按本次执行更新了文件列表，此后只参考新的日志
+    since = time.time()
+
+    state = rename_journal.latest_undoable(journal_dir)
+    inverse = state.inverse_schedule()
+    journal = rename_journal.RenameJournal.create(inverse, journal_dir)
+    rename_apply.run_schedule(inverse, journal.on_step)
+    journal.close()
+    # 撤销标记追加在原日志末尾，原日志的 mtime 晚于 since
+    state.mark_undone()
+    a, b = os.path.join(folder, "a"), os.path.join(folder, "b")
+    assert rename_journal.renamed_paths(journal_dir, since=since) == {b: a}
+
+
+def test_undo_run_is_not_undoable(tmp_path):
+    folder, journal_dir = str(tmp_path / "files"), str(tmp_path / "journal")
+    os.mkdir(folder)
+    _touch(folder, "a")
+    _run([(folder, "a", "b")], journal_dir)
+
+    state = rename_journal.latest_undoable(journal_dir)
+    inverse = state.inverse_schedule()
+    journal = rename_journal.RenameJournal.create(inverse, journal_dir, undo_of=state.path)
+    rename_apply.run_schedule(inverse, journal.on_step)
+    journal.close()
+    state.mark_undone()
+    # 再次撤销不能把撤销本身当作一次重命名，重新执行原来的改名
+    assert rename_journal.latest_undoable(journal_dir) is None
+
+
+def test_close_unfinished_keeps_journal_interrupted(tmp_path):
+    folder, journal_dir = str(tmp_path / "files"), str(tmp_path / "journal")
+    os.mkdir(folder)
+    _touch(folder, "a")
+    schedule = rename_apply.schedule_renames([(folder, "a", "b")])
+    journal = rename_journal.RenameJournal.create(schedule, journal_dir)
+    journal.close(finished=False)
+    assert [state.path for state in rename_journal.find_interrupted(journal_dir)] == [journal.path]
+    assert rename_journal.latest_undoable(journal_dir) is None